@@ -4,7 +4,8 @@ export interface Meta {
   tables: string[];
   activities: string[];
   query: string;
-  result: Record<string, any>[];
+  result?: Record<string, any>[];
+  resultRows?: number;
   plotPath: string | undefined;
   plotBase64: string | undefined;
   fbSubmitted: boolean;
@@ -20,6 +21,19 @@ export interface Message {
   error?: boolean;
 }
 
+export function rowsFromColumns(columns: string[], values: any[][]): Record<string, any>[] {
+  const rowCount = values[0]?.length ?? 0;
+  const rows: Record<string, any>[] = new Array(rowCount);
+  for (let i = 0; i < rowCount; i++) {
+    const row: Record<string, any> = {};
+    columns.forEach((column, c) => {
+      row[column] = values[c][i];
+    });
+    rows[i] = row;
+  }
+  return rows;
+}
+
 export function useChatWebSocket() {
   const socket = ref<WebSocket | null>(null);
   const messages = ref<Message[]>([]);
@@ -36,6 +50,8 @@ export function useChatWebSocket() {
     };
   } | null>(null);
   const partialMessages = new Map<string, string>();
+  let pendingInterruption: typeof interruptionMeta.value = null;
+  let pendingColumns: string[] = [];
 
   const connect = (): Promise<void> => {
     return new Promise((resolve, reject) => {
@@ -68,17 +84,31 @@ export function useChatWebSocket() {
           steps.value = [data.node];
         } else if (data.type === 'interruption') {
           steps.value = [];
-          interruptionMeta.value = {
+          // Rows follow as result_batch frames; the interruption is published on result_end
+          pendingColumns = data.columns ?? [];
+          pendingInterruption = {
             query: data.query,
-            data: data.data,
+            data: [],
             chat_id: data.chat_id,
             reason: {
               auto_approve: data.reason.auto_approve,
               auto_sql: data.reason.auto_sql
             }
           };
+        } else if (data.type === 'result_batch') {
+          if (pendingInterruption) {
+            for (const row of rowsFromColumns(pendingColumns, data.values)) {
+              pendingInterruption.data.push(row);
+            }
+          }
+        } else if (data.type === 'result_end') {
+          interruptionMeta.value = pendingInterruption;
+          pendingInterruption = null;
+          pendingColumns = [];
         } else if (data.type === 'chunk') {
-          const { id, content } = data;
+          // Chunks carry only the text added since the previous chunk
+          const { id, delta } = data;
+          const content = (partialMessages.get(id) ?? '') + delta;
           if (!partialMessages.has(id)) {
             const partialMessage: Message = {
               id,
@@ -140,6 +170,7 @@ export function useChatWebSocket() {
       autoSQL?: boolean;
       answerDetail?: string;
       wantsPlot?: string;
+      parallelPlot?: boolean;
     }
   ) => {
     steps.value = [];
@@ -152,7 +183,8 @@ export function useChatWebSocket() {
       auto_approve: options?.autoApprove ?? false,
       auto_sql: options?.autoSQL ?? true,
       answer_detail: options?.answerDetail ?? 'auto',
-      wants_plot: options?.wantsPlot ?? 'auto'
+      wants_plot: options?.wantsPlot ?? 'auto',
+      parallel_plot: options?.parallelPlot ?? false
     });
 
     if (!socket.value || socket.value.readyState !== WebSocket.OPEN) {
@@ -0,0 +1,77 @@
+"""Point the backend at throwaway files before any of its modules are imported.
+
+Import this first in every benchmark. The app data directory, the tracker's database
+and the chat checkpoints all live in a temporary directory that is removed on exit.
+"""
+import atexit
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+from datetime import datetime, timedelta
+from pathlib import Path
+
+SRC_DIR = Path(__file__).resolve().parents[1] / "src"
+sys.path.insert(0, str(SRC_DIR))
+
+TMP_DIR = Path(tempfile.mkdtemp(prefix="pq-benchmark-"))
+atexit.register(shutil.rmtree, TMP_DIR, ignore_errors=True)
+
+TRACKER_DB_PATH = TMP_DIR / "tracker.db"
+os.environ["PQ_APP_DATA_DIR"] = str(TMP_DIR / "personal-query")
+os.environ["APPDATA"] = str(TMP_DIR)
+os.environ["PERSONALQUERY_DB_PATH"] = str(TRACKER_DB_PATH)
+os.environ["OPENAI_API_KEY"] = "benchmark"
+os.environ["LANGSMITH_TRACING"] = "false"
+os.environ["PQ_PROMPT_REFRESH"] = "0"
+os.environ["PQ_COMPACT_ON_STARTUP"] = "0"
+
+ACTIVITIES = ["DevCode", "Email", "WorkRelatedBrowsing", "Planning", "ReadWriteDocument"]
+START = datetime(2025, 5, 1, 8)
+
+
+def _ts(value: datetime) -> str:
+    return value.strftime("%Y-%m-%d %H:%M:%S.") + f"{value.microsecond // 1000:03d}"
+
+
+def create_tracker_db(window_rows: int = 20_000, path: Path = TRACKER_DB_PATH) -> Path:
+    """A PersonalAnalytics database with window_activity, user_input and session rows from START on."""
+    rng = random.Random(1)
+    windows, inputs, sessions = [], [], []
+    ts = START
+    for i in range(window_rows):
+        duration = rng.randint(5, 300)
+        end = ts + timedelta(seconds=duration)
+        windows.append((f"w{i}", f"Title {i % 7}", f"process-{i % 5}.exe", "", 1, None,
+                        rng.choice(ACTIVITIES), _ts(ts), _ts(end), duration))
+        minute = ts
+        while minute < end:
+            inputs.append((f"u{len(inputs)}", rng.randint(0, 80), rng.randint(0, 10), rng.random() * 500,
+                           rng.randint(0, 50), _ts(minute), _ts(minute + timedelta(minutes=1))))
+            minute += timedelta(minutes=1)
+        ts = end
+    session_start = START
+    while session_start < ts:
+        sessions.append((f"s{len(sessions)}", "How productive were you?", 7, rng.randint(1, 7), 0,
+                         _ts(session_start), _ts(session_start + timedelta(hours=1)), 3600))
+        session_start += timedelta(hours=rng.choice([1, 2, 3]))
+
+    conn = sqlite3.connect(path)
+    with conn:
+        conn.executescript("""
+            CREATE TABLE window_activity (id varchar PRIMARY KEY NOT NULL, windowTitle text, processName text,
+                processPath text, processId int, url text, activity text NOT NULL, tsStart datetime,
+                tsEnd datetime, durationInSeconds integer);
+            CREATE TABLE user_input (id varchar PRIMARY KEY NOT NULL, keysTotal int NOT NULL,
+                clickTotal int NOT NULL, movedDistance float NOT NULL, scrollDelta int NOT NULL,
+                tsStart datetime NOT NULL, tsEnd datetime NOT NULL);
+            CREATE TABLE session (id varchar PRIMARY KEY NOT NULL, question text, scale int, response int,
+                skipped boolean, tsStart datetime, tsEnd datetime, durationInSeconds int NOT NULL);
+        """)
+        conn.executemany("INSERT INTO window_activity VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", windows)
+        conn.executemany("INSERT INTO user_input VALUES (?, ?, ?, ?, ?, ?, ?)", inputs)
+        conn.executemany("INSERT INTO session VALUES (?, ?, ?, ?, ?, ?, ?, ?)", sessions)
+    conn.close()
+    return path
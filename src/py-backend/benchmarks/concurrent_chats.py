@@ -0,0 +1,116 @@
+"""Check that concurrent chats wait on the LLMs together instead of one after another.
+
+Runs one data query chat and then N concurrent ones through the whole graph, from
+classify_question over plan_query, write_query, check_query and execute_query to
+generate_answer. Stub LLMs with a fixed latency are registered in LLMRegistry and the
+prompts are stubbed, so nothing leaves the machine. Fails if the concurrent chats take
+more than TOLERANCE times as long as one.
+
+    python benchmarks/concurrent_chats.py [N] [latency in seconds]
+"""
+import bench_env
+
+import asyncio
+import sys
+import time
+import uuid
+
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.runnables import RunnableLambda
+
+import chat_engine
+import prompt_store
+from llm_registry import LLMRegistry
+from schemas import Question, QueryOutput, QueryPlan, QuestionType, TimeGrouping, WantsPlot
+
+TOLERANCE = 2.0
+QUESTION = "How much time did I spend per activity on May 1st?"
+QUERY = """
+SELECT activity, SUM(durationInSeconds) AS total_seconds
+FROM window_activity
+WHERE tsStart >= '2025-05-01' AND tsStart < '2025-05-02'
+GROUP BY activity
+ORDER BY total_seconds DESC
+"""
+# The prompts invoked with a plain string instead of a dict of variables
+STRING_PROMPTS = {"classify_question", "give_context", "general_answer"}
+
+
+def stub_prompts():
+    """Write a bundle with placeholder templates for every prompt, so none is pulled from the hub."""
+    prompt_store._write_bundle(prompt_store._refreshed_bundle_path(), {
+        name: prompt_store._bundle_entry(ChatPromptTemplate.from_messages([
+            ("system", f"Prompt {name}: {{input}}" if name in STRING_PROMPTS else f"Prompt {name}")
+        ]))
+        for name in prompt_store.PROMPT_NAMES
+    })
+
+
+class StubLLM:
+    """Answers every node of a data query chat after a fixed delay."""
+    # Not deterministic, so the response cache stays out of the measurement
+    temperature = 1.0
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.structured = {
+            QuestionType: QuestionType(questionType="data_query", insightMode="descriptive"),
+            Question: {"question": QUESTION},
+            QueryPlan: QueryPlan(tables=["window_activity"], timeGrouping=TimeGrouping.day,
+                                 timeFilter={"type": "single", "date": "2025-05-01"}),
+            QueryOutput: {"query": QUERY},
+        }
+
+    def with_structured_output(self, schema):
+        async def answer(_):
+            await asyncio.sleep(self.latency)
+            return self.structured[schema]
+
+        return RunnableLambda(answer)
+
+    async def ainvoke(self, messages, *args, **kwargs):
+        await asyncio.sleep(self.latency)
+        return AIMessage(content="Benchmark")
+
+    async def astream(self, messages, *args, **kwargs):
+        for word in ("Benchmark ", "answer."):
+            await asyncio.sleep(self.latency / 2)
+            yield AIMessageChunk(content=word)
+
+
+async def run_chats(count: int) -> float:
+    start = time.perf_counter()
+    results = await asyncio.gather(*(
+        chat_engine.run_chat(QUESTION, str(uuid.uuid4()), auto_sql=True, auto_approve=True,
+                             wants_plot=WantsPlot.NO)
+        for _ in range(count)
+    ))
+    elapsed = time.perf_counter() - start
+    for result in results:
+        assert result.get("content") == "Benchmark answer.", result
+        assert result["additional_kwargs"]["meta"]["result"], "the query returned no rows"
+    return elapsed
+
+
+async def main(chat_count: int, latency: float):
+    bench_env.create_tracker_db()
+    stub_prompts()
+    await chat_engine.initialize()
+    for name in ("openai", "openai-high-temp", "openai-mini"):
+        LLMRegistry.register(name, StubLLM(latency))
+    try:
+        single = await run_chats(1)
+        concurrent = await run_chats(chat_count)
+    finally:
+        await chat_engine.shutdown()
+
+    print(f"LLM latency {latency:.2f} s per call")
+    print(f"1 chat:              {single:.2f} s")
+    print(f"{chat_count} concurrent chats: {concurrent:.2f} s ({concurrent / single:.1f}x)")
+    assert concurrent <= single * TOLERANCE, f"{chat_count} concurrent chats took {concurrent / single:.1f}x one chat"
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 20,
+                     float(sys.argv[2]) if len(sys.argv) > 2 else 0.2))
@@ -0,0 +1,73 @@
+"""Time the first and a middle page of list_chats on a temporary database with many chats.
+
+    python benchmarks/list_chats.py [threads]
+"""
+import bench_env
+
+import asyncio
+import sys
+import time
+from datetime import datetime, timedelta, UTC
+
+from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+
+from chat_db import ChatDB
+from helper.chat_utils import list_chats
+
+PAGE_SIZE = 50
+REPEATS = 20
+
+
+async def measure(after: str | None) -> tuple[dict, float]:
+    start = time.perf_counter()
+    for _ in range(REPEATS):
+        page = await list_chats(after, PAGE_SIZE)
+    return page, (time.perf_counter() - start) / REPEATS * 1000
+
+
+async def seed(thread_count: int):
+    await AsyncSqliteSaver(ChatDB.connection()).setup()
+    now = datetime.now(UTC)
+    async with ChatDB.transaction() as conn:
+        await conn.execute("""
+            CREATE TABLE chat_metadata (
+                thread_id TEXT PRIMARY KEY,
+                title TEXT,
+                last_activity TEXT
+            )
+        """)
+        await conn.execute("""
+            CREATE INDEX idx_chat_metadata_last_activity
+            ON chat_metadata (last_activity DESC, thread_id DESC)
+        """)
+        await conn.executemany(
+            "INSERT INTO chat_metadata (thread_id, title, last_activity) VALUES (?, ?, ?)",
+            [(str(i), f"Chat {i}", (now - timedelta(minutes=i)).isoformat()) for i in range(thread_count)]
+        )
+        # A few checkpoints per thread, as LangGraph keeps one per step
+        await conn.executemany(
+            "INSERT INTO checkpoints (thread_id, checkpoint_ns, checkpoint_id, type, checkpoint, metadata) "
+            "VALUES (?, '', ?, 'msgpack', ?, ?)",
+            [(str(i), str(step), b"\x00" * 512, b"{}") for i in range(thread_count) for step in range(3)]
+        )
+
+
+async def main(thread_count: int):
+    await ChatDB.open(bench_env.TMP_DIR / "chat_checkpoints.db")
+    try:
+        await seed(thread_count)
+        _, first_ms = await measure(None)
+        after = None
+        for _ in range(thread_count // PAGE_SIZE // 2):
+            after = (await list_chats(after, PAGE_SIZE))["next_cursor"]
+        page, middle_ms = await measure(after)
+    finally:
+        await ChatDB.close()
+
+    print(f"{thread_count} threads, {PAGE_SIZE} chats per page")
+    print(f"first page:  {first_ms:.2f} ms")
+    print(f"middle page: {middle_ms:.2f} ms (starts at chat {page['chats'][0]['id']})")
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 10_000))
@@ -0,0 +1,67 @@
+"""Time N concurrent submit_query calls with one query worker and with POOL_SIZE workers.
+
+Each pool size runs in its own process, since database reads PQ_SQLITE_POOL_SIZE on
+import. Every call gets a distinct query, so none of them is answered from the result
+cache. SQLite releases the GIL while a statement runs, so the speedup is bounded by
+the number of CPU cores.
+
+    python benchmarks/query_pool.py [N]
+"""
+import bench_env
+
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+
+# A range join over the first hour of the generated data, a few hundred ms per query
+QUERY = """
+SELECT {run} AS run, w.activity, COUNT(*) AS inputs, SUM(u.keysTotal) AS keys
+FROM window_activity w
+JOIN user_input u ON u.tsStart >= w.tsStart AND u.tsStart < w.tsEnd
+WHERE w.tsStart < '2025-05-01 09:00'
+GROUP BY w.activity
+"""
+
+
+async def run_queries(query_count: int) -> dict:
+    from database import POOL_SIZE, submit_query
+
+    bench_env.create_tracker_db()
+    # Opens this worker's connection, so the timing below only covers the queries
+    await submit_query("SELECT 1")
+    start = time.perf_counter()
+    results = await asyncio.gather(*(submit_query(QUERY.format(run=run)) for run in range(query_count)))
+    elapsed = time.perf_counter() - start
+    rows = {len(table) for table, _ in results}
+    return {"pool_size": POOL_SIZE, "seconds": elapsed, "rows": sorted(rows)}
+
+
+def measure(pool_size: str | None, query_count: int) -> dict:
+    env = dict(os.environ)
+    env.pop("PQ_SQLITE_POOL_SIZE", None)
+    if pool_size:
+        env["PQ_SQLITE_POOL_SIZE"] = pool_size
+    output = subprocess.run([sys.executable, __file__, "--worker", str(query_count)], env=env,
+                            capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main(query_count: int):
+    single = measure("1", query_count)
+    pooled = measure(None, query_count)
+    assert single["rows"] == pooled["rows"], "the pool sizes returned different results"
+
+    print(f"{query_count} concurrent queries on {os.cpu_count()} CPU cores")
+    print(f"pool size {single['pool_size']}: {single['seconds']:.2f} s")
+    print(f"pool size {pooled['pool_size']}: {pooled['seconds']:.2f} s "
+          f"(speedup {single['seconds'] / pooled['seconds']:.1f}x)")
+
+
+if __name__ == "__main__":
+    if "--worker" in sys.argv:
+        print(json.dumps(asyncio.run(run_queries(int(sys.argv[-1])))))
+    else:
+        main(int(sys.argv[1]) if len(sys.argv) > 1 else 16)
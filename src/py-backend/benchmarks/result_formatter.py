@@ -0,0 +1,39 @@
+"""Rows per second of the former per-cell markdown formatter and the current one on the same table.
+
+    python benchmarks/result_formatter.py [rows]
+"""
+import bench_env  # noqa: F401
+
+import sys
+import time
+
+from helper.result_utils import escape_md_cell, format_result_as_markdown
+from result_table import ResultTable
+
+
+def format_result_as_markdown_baseline(result: ResultTable) -> str:
+    """The former per-cell list implementation of format_result_as_markdown()."""
+    headers = ["#"] + list(result.columns)
+    lines = ["| " + " | ".join(headers) + " |", "| " + " | ".join(["---"] * len(headers)) + " |"]
+    for idx, row in enumerate(result.iter_rows(), start=1):
+        row_values = [str(idx)] + [escape_md_cell(str(value)) for value in row]
+        lines.append("| " + " | ".join(row_values) + " |")
+    return "\n".join(lines)
+
+
+def main(row_count: int):
+    columns = ["id", "processName", "windowTitle", "durationInSeconds", "url"]
+    result = ResultTable.from_rows(columns, [
+        (i, f"process-{i % 50}.exe", f"Title {i} | draft", i % 3600, None if i % 3 else f"https://x/{i}")
+        for i in range(row_count)
+    ])
+    for name, formatter in (("baseline", format_result_as_markdown_baseline),
+                            ("streaming", format_result_as_markdown)):
+        start = time.perf_counter()
+        formatter(result)
+        elapsed = time.perf_counter() - start
+        print(f"{name:>10}: {row_count / elapsed:,.0f} rows/s")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200_000)
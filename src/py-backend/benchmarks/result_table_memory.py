@@ -0,0 +1,35 @@
+"""Compare the traced allocation of per-row dicts and a ResultTable for the same rows.
+
+    python benchmarks/result_table_memory.py [rows]
+"""
+import bench_env  # noqa: F401
+
+import sys
+import tracemalloc
+
+from result_table import ResultTable
+
+
+def measure(build):
+    tracemalloc.start()
+    result = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, size
+
+
+def main(row_count: int):
+    columns = ["id", "processName", "durationInSeconds", "score"]
+    rows, rows_size = measure(lambda: [
+        (i, f"process-{i % 50}.exe", i % 3600, i / 7) for i in range(row_count)
+    ])
+    _, dict_size = measure(lambda: [dict(zip(columns, row)) for row in rows])
+    _, table_size = measure(lambda: ResultTable.from_rows(columns, rows))
+
+    print(f"{row_count} rows, cursor tuples: {rows_size / 2**20:.1f} MiB")
+    print(f"per-row dicts:  {dict_size / 2**20:.1f} MiB")
+    print(f"ResultTable:    {table_size / 2**20:.1f} MiB")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000)
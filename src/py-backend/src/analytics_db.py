@@ -0,0 +1,270 @@
+import asyncio
+import heapq
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, Iterator
+
+from database import DB_PATH, get_analytics_db_path, get_query_db_path, get_source_version
+
+ANALYTICS_DB_PATH = get_analytics_db_path()
+ROLLUPS_ENABLED = os.getenv("PQ_ROLLUPS", "1") == "1"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS rollup_state (
+    source TEXT PRIMARY KEY,
+    watermark TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS rollup_window_activity_hourly (
+    hour TEXT NOT NULL,
+    activity TEXT,
+    processName TEXT,
+    durationInSeconds REAL NOT NULL,
+    row_count INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_rollup_window_activity_hourly_hour
+    ON rollup_window_activity_hourly (hour, activity, processName);
+CREATE TABLE IF NOT EXISTS rollup_context_switch_hourly (
+    hour TEXT NOT NULL,
+    from_activity TEXT,
+    to_activity TEXT,
+    switch_count INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_rollup_context_switch_hourly_hour
+    ON rollup_context_switch_hourly (hour);
+CREATE TABLE IF NOT EXISTS rollup_user_input_hourly (
+    hour TEXT PRIMARY KEY,
+    keysTotal INTEGER NOT NULL,
+    clickTotal INTEGER NOT NULL,
+    movedDistance REAL NOT NULL,
+    scrollDelta REAL NOT NULL,
+    row_count INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS user_input_interval_map (
+    user_input_id TEXT PRIMARY KEY,
+    tsStart TEXT NOT NULL,
+    window_activity_id TEXT,
+    session_id TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_user_input_interval_map_ts ON user_input_interval_map (tsStart);
+CREATE INDEX IF NOT EXISTS idx_user_input_interval_map_window ON user_input_interval_map (window_activity_id);
+CREATE INDEX IF NOT EXISTS idx_user_input_interval_map_session ON user_input_interval_map (session_id);
+CREATE TABLE IF NOT EXISTS window_activity_session_map (
+    window_activity_id TEXT PRIMARY KEY,
+    tsStart TEXT NOT NULL,
+    session_id TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_window_activity_session_map_ts ON window_activity_session_map (tsStart);
+CREATE INDEX IF NOT EXISTS idx_window_activity_session_map_session ON window_activity_session_map (session_id);
+"""
+
+HOUR = "strftime('%Y-%m-%d %H:00:00', tsStart)"
+
+# Every rollup is rebuilt from the start of the hour that holds its watermark, so rows
+# that arrive late for that hour or share the watermark's timestamp are not lost.
+ROLLUPS = {
+    "window_activity": [
+        "DELETE FROM rollup_window_activity_hourly WHERE hour >= :from_hour",
+        f"""
+        INSERT INTO rollup_window_activity_hourly (hour, activity, processName, durationInSeconds, row_count)
+        SELECT {HOUR}, activity, processName, SUM(durationInSeconds), COUNT(*)
+        FROM pa.window_activity
+        WHERE tsStart >= :from_hour
+        GROUP BY 1, 2, 3
+        """,
+        "DELETE FROM rollup_context_switch_hourly WHERE hour >= :from_hour",
+        f"""
+        INSERT INTO rollup_context_switch_hourly (hour, from_activity, to_activity, switch_count)
+        SELECT {HOUR}, prev_activity, activity, COUNT(*)
+        FROM (
+            SELECT tsStart, activity, LAG(activity) OVER (ORDER BY tsStart) AS prev_activity
+            FROM pa.window_activity
+            -- Start one row early so the first switch of the hour has its predecessor
+            WHERE tsStart >= COALESCE(
+                (SELECT MAX(tsStart) FROM pa.window_activity WHERE tsStart < :from_hour), :from_hour
+            )
+        )
+        WHERE tsStart >= :from_hour AND activity != prev_activity
+        GROUP BY 1, 2, 3
+        """
+    ],
+    "user_input": [
+        "DELETE FROM rollup_user_input_hourly WHERE hour >= :from_hour",
+        f"""
+        INSERT INTO rollup_user_input_hourly (hour, keysTotal, clickTotal, movedDistance, scrollDelta, row_count)
+        SELECT {HOUR}, SUM(keysTotal), SUM(clickTotal), SUM(movedDistance), SUM(scrollDelta), COUNT(*)
+        FROM pa.user_input
+        WHERE tsStart >= :from_hour
+        GROUP BY 1
+        """
+    ]
+}
+
+
+class IntervalSweep:
+    """Finds the interval enclosing each of a series of timestamps in nondecreasing order.
+
+    Intervals must arrive sorted by start. Of several enclosing intervals the one that
+    started last wins, so every timestamp is assigned at most once. Each interval is
+    pushed and popped once, which makes a full pass O((n + m) log m).
+    """
+
+    def __init__(self, intervals: Iterable[tuple[str, str, str]]):
+        self._intervals = iter(intervals)
+        self._next = next(self._intervals, None)
+        self._active: list[tuple[int, str, str]] = []
+        self._seq = 0
+
+    def find(self, ts: str) -> str | None:
+        while self._next is not None and self._next[1] <= ts:
+            interval_id, _, end = self._next
+            # Max-heap on start order via the negated arrival sequence
+            heapq.heappush(self._active, (-self._seq, end, interval_id))
+            self._seq += 1
+            self._next = next(self._intervals, None)
+        while self._active and self._active[0][1] < ts:
+            heapq.heappop(self._active)
+        return self._active[0][2] if self._active else None
+
+
+def _map_intervals(conn: sqlite3.Connection, points_sql: str, interval_sqls: list[str],
+                   from_ts: str) -> Iterator[tuple]:
+    # Any interval that can enclose a point at or after from_ts ends at or after it
+    sweeps = [IntervalSweep(conn.cursor().execute(sql, {"from_ts": from_ts})) for sql in interval_sqls]
+    for point_id, ts in conn.cursor().execute(points_sql, {"from_ts": from_ts}):
+        yield (point_id, ts, *(sweep.find(ts) for sweep in sweeps))
+
+
+WINDOWS_SQL = "SELECT id, tsStart, tsEnd FROM pa.window_activity WHERE tsEnd >= :from_ts ORDER BY tsStart"
+SESSIONS_SQL = "SELECT id, tsStart, tsEnd FROM pa.session WHERE tsEnd >= :from_ts ORDER BY tsStart"
+
+
+def refresh_interval_maps(conn: sqlite3.Connection):
+    """Assign user_input rows to their window_activity and session, and windows to their session.
+
+    Replaces the u.tsStart BETWEEN w.tsStart AND w.tsEnd range joins of the aggregation
+    templates with equi-joins on ids. Rows from the watermark on are re-mapped, where the
+    watermark is the earliest of the newest tsStart of the three tables at the last refresh:
+    an interval that was not written yet at that point starts after it.
+    """
+    row = conn.execute("SELECT watermark FROM rollup_state WHERE source = 'interval_map'").fetchone()
+    from_ts = row[0] if row else ""
+    conn.execute("DELETE FROM user_input_interval_map WHERE tsStart >= ?", (from_ts,))
+    conn.executemany(
+        "INSERT INTO user_input_interval_map (user_input_id, tsStart, window_activity_id, session_id) VALUES (?, ?, ?, ?)",
+        _map_intervals(
+            conn,
+            "SELECT id, tsStart FROM pa.user_input WHERE tsStart >= :from_ts ORDER BY tsStart",
+            [WINDOWS_SQL, SESSIONS_SQL],
+            from_ts
+        )
+    )
+    conn.execute("DELETE FROM window_activity_session_map WHERE tsStart >= ?", (from_ts,))
+    conn.executemany(
+        "INSERT INTO window_activity_session_map (window_activity_id, tsStart, session_id) VALUES (?, ?, ?)",
+        _map_intervals(
+            conn,
+            "SELECT id, tsStart FROM pa.window_activity WHERE tsStart >= :from_ts ORDER BY tsStart",
+            [SESSIONS_SQL],
+            from_ts
+        )
+    )
+    watermark = conn.execute("""
+        SELECT MIN(newest) FROM (
+            SELECT MAX(tsStart) AS newest FROM pa.user_input
+            UNION ALL SELECT MAX(tsStart) FROM pa.window_activity
+            UNION ALL SELECT MAX(tsStart) FROM pa.session
+        )
+    """).fetchone()[0]
+    conn.execute("""
+        INSERT INTO rollup_state (source, watermark) VALUES ('interval_map', ?)
+        ON CONFLICT(source) DO UPDATE SET watermark = excluded.watermark
+    """, (watermark or from_ts,))
+    return {"from": from_ts, "watermark": watermark}
+
+
+class AnalyticsDB:
+    """Sidecar database with hourly rollups and interval mappings of the PersonalAnalytics tables.
+
+    The tracker owns the PersonalAnalytics database, so derived tables live in a separate
+    file. It is attached read-only as `analytics` to every query connection and refreshed
+    incrementally from the last ingested tsStart of each source table.
+    """
+    _lock = threading.Lock()
+    _refreshed_version: tuple | None = None
+    _ready = False
+
+    @classmethod
+    def connect(cls) -> sqlite3.Connection:
+        ANALYTICS_DB_PATH.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(str(ANALYTICS_DB_PATH), uri=True, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    @classmethod
+    def ensure_schema(cls):
+        """Create the sidecar file before the first query connection tries to attach it."""
+        conn = cls.connect()
+        try:
+            conn.executescript(SCHEMA)
+        finally:
+            conn.close()
+
+    @classmethod
+    def is_ready(cls) -> bool:
+        return ROLLUPS_ENABLED and cls._ready
+
+    @classmethod
+    def refresh(cls) -> Dict:
+        """Bring the rollups and interval maps up to date with the PersonalAnalytics database.
+
+        Skipped when the tracker has not committed since the last refresh.
+        """
+        if not DB_PATH.exists():
+            raise FileNotFoundError("PersonalQuery database does not exist.")
+        with cls._lock:
+            version = get_source_version()
+            if version == cls._refreshed_version:
+                return {}
+            start = time.perf_counter()
+            conn = cls.connect()
+            report = {}
+            try:
+                conn.executescript(SCHEMA)
+                conn.execute("ATTACH DATABASE ? AS pa", (f"file:{get_query_db_path()}?mode=ro",))
+                with conn:
+                    for source, statements in ROLLUPS.items():
+                        row = conn.execute("SELECT watermark FROM rollup_state WHERE source = ?", (source,)).fetchone()
+                        watermark = row[0] if row else ""
+                        from_hour = conn.execute(
+                            "SELECT COALESCE(strftime('%Y-%m-%d %H:00:00', ?), '')", (watermark,)
+                        ).fetchone()[0]
+                        for statement in statements:
+                            conn.execute(statement, {"from_hour": from_hour})
+                        new_watermark = conn.execute(f"SELECT MAX(tsStart) FROM pa.{source}").fetchone()[0]
+                        conn.execute("""
+                            INSERT INTO rollup_state (source, watermark) VALUES (?, ?)
+                            ON CONFLICT(source) DO UPDATE SET watermark = excluded.watermark
+                        """, (source, new_watermark or watermark))
+                        report[source] = {"from": from_hour, "watermark": new_watermark}
+                    report["interval_map"] = refresh_interval_maps(conn)
+            finally:
+                conn.close()
+            cls._refreshed_version = version
+            cls._ready = True
+            logging.info(f"[AnalyticsDB] Rollups refreshed in {(time.perf_counter() - start) * 1000:.0f} ms")
+            return report
+
+    @classmethod
+    async def refresh_async(cls) -> bool:
+        """Refresh off the event loop; returns whether the rollups can be queried."""
+        if not ROLLUPS_ENABLED:
+            return False
+        try:
+            await asyncio.to_thread(cls.refresh)
+        except Exception as e:
+            logging.warning(f"[AnalyticsDB] Rollup refresh failed: {e}")
+        return cls.is_ready()
@@ -0,0 +1,114 @@
+import base64
+import hashlib
+import json
+import logging
+import re
+import tempfile
+import time
+from pathlib import Path
+from typing import Iterable
+
+from paths import get_app_data_dir
+from result_table import ResultTable
+
+BLOB_DIR = get_app_data_dir() / "blobs"
+# References as they appear in serialized checkpoints
+BLOB_REF_PATTERN = re.compile(rb"sha256:([0-9a-f]{64})")
+# Blobs are written before the checkpoint referencing them, so new ones are never collected
+BLOB_GRACE_SECONDS = 3600
+
+
+class BlobStore:
+    """Content-addressed files for large payloads that should not live in checkpoints.
+
+    References have the form "sha256:<hex>" and identical payloads share one file.
+    """
+
+    @classmethod
+    def _path(cls, digest: str) -> Path:
+        return BLOB_DIR / digest[:2] / digest
+
+    @classmethod
+    def put_bytes(cls, data: bytes) -> str:
+        digest = hashlib.sha256(data).hexdigest()
+        path = cls._path(digest)
+        if not path.exists():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            # A unique temp file per writer, so threads storing the same payload do not collide
+            with tempfile.NamedTemporaryFile(dir=path.parent, prefix=f"{digest}.", suffix=".tmp",
+                                             delete=False) as tmp:
+                tmp.write(data)
+            Path(tmp.name).replace(path)
+        return f"sha256:{digest}"
+
+    @classmethod
+    def get_bytes(cls, ref: str) -> bytes:
+        algorithm, _, digest = ref.partition(":")
+        if algorithm != "sha256" or not digest:
+            raise ValueError(f"Invalid blob reference '{ref}'")
+        return cls._path(digest).read_bytes()
+
+    @classmethod
+    def collect_garbage(cls, referenced: Iterable[str], grace_seconds: float = BLOB_GRACE_SECONDS) -> dict:
+        """Delete blobs whose digest is not in referenced, except those written in the last grace_seconds."""
+        referenced = set(referenced)
+        cutoff = time.time() - grace_seconds
+        deleted, freed = 0, 0
+        if not BLOB_DIR.exists():
+            return {"deleted_blobs": 0, "bytes_freed": 0}
+        for path in BLOB_DIR.glob("*/*"):
+            try:
+                stat = path.stat()
+                if path.name in referenced or stat.st_mtime > cutoff:
+                    continue
+                path.unlink()
+            except OSError as e:
+                logging.warning(f"[BlobStore] Could not delete {path.name}: {e}")
+                continue
+            deleted += 1
+            freed += stat.st_size
+        return {"deleted_blobs": deleted, "bytes_freed": freed}
+
+    @classmethod
+    def put_json(cls, obj) -> str:
+        return cls.put_bytes(json.dumps(obj, default=str, separators=(",", ":")).encode("utf-8"))
+
+    @classmethod
+    def get_json(cls, ref: str):
+        return json.loads(cls.get_bytes(ref))
+
+
+def store_message_payloads(meta: dict, raw_result: ResultTable | None, plot_base64: str | None) -> dict:
+    """Move the result rows and the plot image of an answer into the blob store."""
+    raw_result = raw_result or ResultTable.empty()
+    meta["resultRef"] = BlobStore.put_json(raw_result.to_json())
+    meta["resultRows"] = len(raw_result)
+    if plot_base64:
+        _, _, encoded = plot_base64.partition("base64,")
+        meta["plotRef"] = BlobStore.put_bytes(base64.b64decode(encoded))
+    return meta
+
+
+PAYLOAD_FIELDS = {"result", "plotBase64"}
+
+
+def resolve_message_meta(meta: dict, exclude: set[str] = frozenset()) -> dict:
+    """Return a copy of an answer's meta with result rows and plot image loaded from the blob store.
+
+    Fields in `exclude` are neither loaded nor returned. Messages stored before the blob
+    store existed carry the payloads inline and are returned unchanged otherwise.
+    """
+    resolved = {key: value for key, value in meta.items() if key not in exclude}
+    if "result" not in exclude and "resultRef" in meta and "result" not in meta:
+        try:
+            # Blobs hold the columnar form; the API keeps returning one object per row
+            resolved["result"] = ResultTable.from_json(BlobStore.get_json(meta["resultRef"])).to_records()
+        except (OSError, ValueError):
+            resolved["result"] = []
+    if "plotBase64" not in exclude and meta.get("plotRef") and not meta.get("plotBase64"):
+        try:
+            encoded = base64.b64encode(BlobStore.get_bytes(meta["plotRef"])).decode("utf-8")
+            resolved["plotBase64"] = f"data:image/png;base64,{encoded}"
+        except (OSError, ValueError):
+            resolved["plotBase64"] = ""
+    return resolved
@@ -1,4 +1,4 @@
-from langchain import hub
+from prompt_store import PromptStore
 from langchain_core.output_parsers import PydanticToolsParser
 
 from helper.env_loader import load_env
@@ -7,10 +7,10 @@ from schemas import ActivityFilterList, State
 
 load_env()
 output_parser = PydanticToolsParser(tools=[ActivityFilterList])
-prompt_template = hub.pull("activity_selection")
+prompt_template = PromptStore.lazy("activity_selection")
 
 
-def extract_activities(state: State) -> State:
+async def extract_activities(state: State) -> State:
     if "window_activity" not in state["tables"]:
         return state
     if not state["adjust_query"] and state["branch"] == "follow_up":
@@ -19,7 +19,7 @@ def extract_activities(state: State) -> State:
     llm = LLMRegistry.get("openai")
     prompt = prompt_template.invoke(state)
 
-    parsed = llm.with_structured_output(ActivityFilterList).invoke(prompt)
+    parsed = await llm.with_structured_output(ActivityFilterList).ainvoke(prompt)
 
     activities = parsed.list
     state["activities"] = activities
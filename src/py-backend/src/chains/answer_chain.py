@@ -1,30 +1,42 @@
-from langchain import hub
-from langchain_core.messages import AIMessage, AIMessageChunk
+import asyncio
+import logging
+import os
+
+from prompt_store import PromptStore
+from langchain_core.messages import AIMessage
 from langchain_core.prompt_values import ChatPromptValue
 
-from helper.answer_utils import convert_bracket_to_dollar_latex
+from blob_store import store_message_payloads
+from chains.plot_chain import run_plot_pipeline, PLOT_STATE_KEYS
+from helper.answer_utils import convert_bracket_to_dollar_latex, estimate_tokens, stream_answer
 from helper.chat_utils import replace_or_insert_system_prompt
 from helper.env_loader import load_env
+from helper.result_utils import format_result_as_markdown, split_result
 from llm_registry import LLMRegistry
-from schemas import State, AnswerDetail
+from schemas import State, AnswerDetail, WantsPlot
 from langchain_openai import ChatOpenAI
 
 load_env()
-prompt_template_partial = hub.pull("partial_answer")
-prompt_template_summarize = hub.pull("summarize_answers")
+# Results estimated above this many tokens are answered per chunk and then summarized
+MAP_REDUCE_THRESHOLD_TOKENS = int(os.getenv("PQ_MAP_REDUCE_THRESHOLD_TOKENS", "60000"))
+MAP_CHUNK_TOKENS = int(os.getenv("PQ_MAP_CHUNK_TOKENS", "20000"))
+MAP_CONCURRENCY = int(os.getenv("PQ_MAP_CONCURRENCY", "4"))
+
+prompt_template_partial = PromptStore.lazy("partial_answer")
+prompt_template_summarize = PromptStore.lazy("summarize_answers")
 
-prompt_template = hub.pull("generate_answer")
-diagnostic_template = hub.pull("answer-diagnostic")
-predictive_template = hub.pull("answer-predictive")
-prescriptive_template = hub.pull("answer-prescriptive")
-descriptive_template = hub.pull("answer-descriptive")
+prompt_template = PromptStore.lazy("generate_answer")
+diagnostic_template = PromptStore.lazy("answer-diagnostic")
+predictive_template = PromptStore.lazy("answer-predictive")
+prescriptive_template = PromptStore.lazy("answer-prescriptive")
+descriptive_template = PromptStore.lazy("answer-descriptive")
 
-diagnostic_template_plot = hub.pull("answer-diagnostic-plot")
-predictive_template_plot = hub.pull("answer-predictive-plot")
-prescriptive_template_plot = hub.pull("answer-prescriptive-plot")
-descriptive_template_plot = hub.pull("answer-descriptive-plot")
+diagnostic_template_plot = PromptStore.lazy("answer-diagnostic-plot")
+predictive_template_plot = PromptStore.lazy("answer-predictive-plot")
+prescriptive_template_plot = PromptStore.lazy("answer-prescriptive-plot")
+descriptive_template_plot = PromptStore.lazy("answer-descriptive-plot")
 
-prompt_template_general = hub.pull("general_answer")
+prompt_template_general = PromptStore.lazy("general_answer")
 
 
 def answer_chain(llm: ChatOpenAI, state: State):
@@ -40,6 +52,39 @@ def answer_chain(llm: ChatOpenAI, state: State):
     return response.content
 
 
+def needs_map_reduce(state: State) -> bool:
+    return sum(estimate_tokens(chunk) for chunk in state["result"]) > MAP_REDUCE_THRESHOLD_TOKENS
+
+
+def map_chunks(state: State) -> list[str]:
+    """Markdown chunks of the result that each fit into one partial-answer prompt."""
+    raw_result = state.get("raw_result")
+    if not raw_result:
+        return state["result"]
+    total_tokens = sum(estimate_tokens(chunk) for chunk in state["result"])
+    rows_per_chunk = max(1, len(raw_result) * MAP_CHUNK_TOKENS // total_tokens)
+    return [format_result_as_markdown(chunk) for chunk in split_result(raw_result, rows_per_chunk)]
+
+
+async def partial_answers(llm: ChatOpenAI, state: State, chunks: list[str]) -> list[str]:
+    """Answer the question for every chunk concurrently, at most MAP_CONCURRENCY requests at a time."""
+    semaphore = asyncio.Semaphore(MAP_CONCURRENCY)
+
+    async def answer_chunk(index: int, chunk: str) -> str:
+        async with semaphore:
+            prompt = prompt_template_partial.invoke({
+                "question": state["question"],
+                "query": state["query"],
+                "result": chunk,
+                "chunk_index": index + 1,
+                "chunk_count": len(chunks)
+            })
+            response = await llm.ainvoke(prompt)
+            return response.content
+
+    return list(await asyncio.gather(*(answer_chunk(i, chunk) for i, chunk in enumerate(chunks))))
+
+
 async def generate_answer(state: State, config: dict) -> State:
     """For LangGraph Orchestration"""
     llm = LLMRegistry.get("openai")
@@ -47,6 +92,11 @@ async def generate_answer(state: State, config: dict) -> State:
     insight_mode = state["insight_mode"]
     ws = config.get("configurable", {}).get("websocket")
 
+    # In parallel mode the plot is generated while the answer streams and attached once both are done
+    plot_task = None
+    if state.get("parallel_plot") and state.get("wants_plot") != WantsPlot.NO and not state.get("plot_code"):
+        plot_task = asyncio.create_task(run_plot_pipeline(state))
+
     code = state['plot_code']
     if code:
         plot = (
@@ -79,47 +129,74 @@ async def generate_answer(state: State, config: dict) -> State:
         AnswerDetail.AUTO: "- Use your judgment to decide the appropriate level of detail based on the question and data."
     }.get(state["answer_detail"], "")
 
-    prompt: ChatPromptValue = template.invoke({
-        "question": state["question"],
-        "result": state["result"],
-        "query": state["query"],
-        "plot_code": plot,
-        "granularity_instruction": granularity_instruction
-    })
-
-    if state['branch'] == "follow_up":
-        temp_messages = replace_or_insert_system_prompt(messages, prompt)
-        stream = llm.astream(temp_messages)
-    else:
-        stream = llm.astream(prompt.to_string())
+    try:
+        if needs_map_reduce(state):
+            chunks = map_chunks(state)
+            if ws:
+                await ws.send_json({"type": "step", "node": f"answer {len(chunks)} result chunks"})
+            answers = await partial_answers(llm, state, chunks)
+            if ws:
+                await ws.send_json({"type": "step", "node": "summarize answers"})
+            prompt: ChatPromptValue = prompt_template_summarize.invoke({
+                "question": state["question"],
+                "query": state["query"],
+                "answers": "\n\n".join(f"Part {i}:\n{answer}" for i, answer in enumerate(answers, start=1)),
+                "plot_code": plot,
+                "granularity_instruction": granularity_instruction
+            })
+        else:
+            prompt: ChatPromptValue = template.invoke({
+                "question": state["question"],
+                "result": state["result"],
+                "query": state["query"],
+                "plot_code": plot,
+                "granularity_instruction": granularity_instruction
+            })
 
-    final_msg = AIMessage(content="")
+        if state['branch'] == "follow_up":
+            temp_messages = replace_or_insert_system_prompt(messages, prompt)
+            stream = llm.astream(temp_messages)
+        else:
+            stream = llm.astream(prompt.to_string())
 
-    async for chunk in stream:
-        if isinstance(chunk, AIMessageChunk):
-            final_msg = chunk if final_msg.content == "" else final_msg + chunk
-            if ws:
-                await ws.send_json({"type": "chunk", "content": convert_bracket_to_dollar_latex(final_msg.content),
-                                    "id": final_msg.id})
+        final_msg = await stream_answer(stream, ws)
+    except BaseException:
+        # The plot is only attached to an answer that was streamed completely
+        if plot_task:
+            plot_task.cancel()
+        raise
 
     formatted_response = convert_bracket_to_dollar_latex(final_msg.content)
     state["answer"] = formatted_response
 
+    if plot_task:
+        try:
+            plot_state = await plot_task
+            for key in PLOT_STATE_KEYS:
+                state[key] = plot_state.get(key)
+        except Exception as e:
+            logging.error(f"[generate_answer] Parallel plot generation failed: {e}")
+
+    meta = {
+        "tables": state["tables"],
+        "activities": [a.name for a in state.get("activities") or []],
+        "query": state["query"],
+        "plotPath": state.get('plot_path', ""),
+        "fbSubmitted": False
+    }
+    # Rows and image go to the blob store so later checkpoints only carry references
+    meta = await asyncio.to_thread(store_message_payloads, meta, state["raw_result"], state.get('plot_base64'))
+
     messages.append(AIMessage(
         content=formatted_response,
         id=final_msg.id,
-        additional_kwargs={
-            "meta": {
-                "tables": state["tables"],
-                "activities": [a.name for a in state.get("activities") or []],
-                "query": state["query"],
-                "result": state["raw_result"],
-                "plotPath": state.get('plot_path', ""),
-                "plotBase64": state.get('plot_base64', ""),
-                "fbSubmitted": False
-            }
-        }
+        additional_kwargs={"meta": meta}
     ))
+
+    # The payloads are not needed after answering and would otherwise be written into every checkpoint
+    state["raw_result"] = None
+    state["result"] = []
+    state["plot_base64"] = None
     return state
 
 
@@ -132,13 +209,7 @@ async def general_answer(state: State, config: dict) -> State:
     temp_messages = replace_or_insert_system_prompt(messages, prompt)
 
     stream = llm.astream(temp_messages)
-    final_msg = AIMessage(content="")
-
-    async for chunk in stream:
-        if isinstance(chunk, AIMessageChunk):
-            final_msg = chunk if final_msg.content == "" else final_msg + chunk
-            if ws:
-                await ws.send_json({"type": "chunk", "content": final_msg.content, "id": final_msg.id})
+    final_msg = await stream_answer(stream, ws, convert_latex=False)
 
     state["answer"] = final_msg.content
     assert isinstance(final_msg, AIMessage)
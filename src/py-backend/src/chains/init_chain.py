@@ -1,23 +1,20 @@
 import logging
-import sqlite3
 
-from langchain import hub
+from prompt_store import PromptStore
 from langchain_core.messages import SystemMessage
 from langchain_core.output_parsers.openai_tools import PydanticToolsParser
 from langchain_core.prompt_values import ChatPromptValue
 from langchain_openai import ChatOpenAI
 
-from database import get_chat_db_path
+from chat_db import ChatDB
 from helper.env_loader import load_env
 from llm_registry import LLMRegistry
 from schemas import QuestionType, State
 
 load_env()
 output_parser = PydanticToolsParser(tools=[QuestionType])
-prompt_template = hub.pull("classify_question")
-prompt_template_title = hub.pull("generate_title")
-
-CHECKPOINT_DB_PATH = get_chat_db_path()
+prompt_template = PromptStore.lazy("classify_question")
+prompt_template_title = PromptStore.lazy("generate_title")
 
 
 def classify_chain(llm: ChatOpenAI):
@@ -28,7 +25,7 @@ def classify_chain(llm: ChatOpenAI):
     )
 
 
-def classify_question(state: State) -> State:
+async def classify_question(state: State) -> State:
     llm = LLMRegistry.get("openai")
     prompt = prompt_template.invoke(state['question'])
     system_prompt = prompt.messages[0].content
@@ -39,7 +36,7 @@ def classify_question(state: State) -> State:
     else:
         temp_messages.insert(0, SystemMessage(content=system_prompt))
 
-    parsed = llm.with_structured_output(QuestionType).invoke(temp_messages)
+    parsed = await llm.with_structured_output(QuestionType).ainvoke(temp_messages)
     state['branch'] = parsed.questionType
     state['insight_mode'] = parsed.insightMode
     return state
@@ -51,7 +48,7 @@ def strip_outer_quotes(text: str) -> str:
     return text.strip()
 
 
-def generate_title(state: State) -> State:
+async def generate_title(state: State) -> State:
     """For LangGraph Orchestration"""
     llm = LLMRegistry.get("openai")
     prompt: ChatPromptValue = prompt_template_title.invoke({
@@ -60,20 +57,16 @@ def generate_title(state: State) -> State:
         "current_time": state['current_time']
     })
 
-    raw_title = llm.invoke(prompt.to_string()).content
+    raw_title = (await llm.ainvoke(prompt.to_string())).content
     title = strip_outer_quotes(raw_title)
     thread_id = state["thread_id"]
 
     try:
-        conn = sqlite3.connect(str(CHECKPOINT_DB_PATH), check_same_thread=False)
-        cursor = conn.cursor()
-        cursor.execute("""
+        await ChatDB.execute("""
                 UPDATE chat_metadata
                 SET title = ?
                 WHERE thread_id = ?
             """, (title.strip(), thread_id))
-        conn.commit()
-        conn.close()
     except Exception as e:
         logging.error(f"[generate_title] Failed to persist title for thread {thread_id}: {e}")
 
@@ -0,0 +1,66 @@
+import logging
+
+from langchain_core.messages import SystemMessage, HumanMessage
+
+from chains.activity_chain import extract_activities, prompt_template as activity_template
+from chains.scope_chain import get_scope, prompt_template as scope_template
+from chains.table_chain import get_tables, prompt_template as table_template
+from helper.env_loader import load_env
+from llm_registry import LLMRegistry
+from schemas import State, QueryPlan
+
+load_env()
+
+
+def build_plan_prompt(state: State) -> list:
+    """Merge the table, activity and scope prompts into one planning request."""
+    sections = [
+        ("Relevant tables (field `tables`)", table_template.invoke(state).to_string()),
+        ("Activity filters (field `activities`, only if `window_activity` is one of the tables)",
+         activity_template.invoke(state).to_string()),
+        ("Query scope (fields `aggregationFeature`, `timeGrouping`, `timeFilter`)", scope_template.invoke({
+            "question": state['question'],
+            "tables": "the tables you select in the `tables` field",
+            "current_time": state['current_time']
+        }).to_string()),
+    ]
+    instructions = "\n\n".join(f"## {title}\n\n{text}" for title, text in sections)
+    # give_context stores the enriched question as the structured Question output
+    question = state['question']
+    if isinstance(question, dict):
+        question = question["question"]
+
+    return [
+        SystemMessage(content=(
+            "You plan a SQL query over the PersonalAnalytics database. Solve all of the following tasks "
+            "for the same user question and return them together in a single answer.\n\n" + instructions
+        )),
+        HumanMessage(content=question)
+    ]
+
+
+async def plan_query(state: State) -> State:
+    """For LangGraph Orchestration
+
+    Replaces get_tables -> extract_activities -> get_scope with a single LLM call and
+    falls back to the individual nodes if the combined plan cannot be produced.
+    """
+    if not state["adjust_query"] and state["branch"] == "follow_up":
+        return await get_scope(state)
+
+    llm = LLMRegistry.get("openai")
+    try:
+        plan = await llm.with_structured_output(QueryPlan).ainvoke(build_plan_prompt(state))
+    except Exception as e:
+        # Also covers plans naming tables that do not exist
+        logging.warning(f"[plan_query] Combined plan failed, falling back to individual nodes: {e}")
+        state = await get_tables(state)
+        state = await extract_activities(state)
+        return await get_scope(state)
+
+    state["tables"] = plan.tables
+    state["activities"] = plan.activities if "window_activity" in plan.tables else state.get("activities")
+    state["aggregation_feature"] = plan.aggregationFeature
+    state["time_grouping"] = plan.timeGrouping
+    state["time_filter"] = plan.timeFilter
+    return state
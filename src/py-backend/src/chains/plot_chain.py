@@ -1,51 +1,75 @@
+import asyncio
+import logging
 import re
+import threading
 from pathlib import Path
 import platform
-from langchain import hub
+from prompt_store import PromptStore
 
-from database import get_app_data_dir
+from paths import get_app_data_dir
 from helper.env_loader import load_env
+from helper.result_utils import format_result_as_markdown
 from llm_registry import LLMRegistry
-from schemas import State, PythonOutput, PlotOption
+from result_table import ResultTable
+from schemas import State, PythonOutput, PlotOption, WantsPlot
 
 import uuid
 import base64
-import matplotlib.pyplot as plt
-import seaborn as sns
-import pandas as pd
-import matplotlib.font_manager as fm
-import plotly.express as px
-import plotly.graph_objects as go
 
 
 load_env()
-prompt_template_auto = hub.pull("auto-plot-decision")
-prompt_template_create = hub.pull("create-plot-py")
-prompt_template_create_again = hub.pull("create-plot-py-again")
+prompt_template_auto = PromptStore.lazy("auto-plot-decision")
+prompt_template_create = PromptStore.lazy("create-plot-py")
+prompt_template_create_again = PromptStore.lazy("create-plot-py-again")
 
 APPDATA_PATH = get_app_data_dir()
 PLOT_DIR = APPDATA_PATH / "plots"
 PLOT_DIR.mkdir(parents=True, exist_ok=True)
+PLOT_CHECK_MAX_TOKENS = 4000
 
 
-def check_if_plot_needed(state: State):
+def load_plot_stack():
+    """Import the plotting libraries on demand so backend startup does not pay for them."""
+    import matplotlib.pyplot as plt
+    import matplotlib.font_manager as fm
+    import seaborn as sns
+    import pandas as pd
+    import plotly.express as px
+    import plotly.graph_objects as go
+    return plt, fm, sns, pd, px, go
+
+
+def warm_plot_stack():
+    """Load the plotting libraries in a background thread once the server is up."""
+    def warm():
+        try:
+            load_plot_stack()
+        except Exception as e:
+            logging.warning(f"[warm_plot_stack] Failed to preload plotting libraries: {e}")
+
+    threading.Thread(target=warm, name="plot-warmup", daemon=True).start()
+
+
+async def check_if_plot_needed(state: State):
     llm = LLMRegistry.get("openai")
 
+    # Deciding whether a plot helps needs the shape of the data, not every row
+    raw_result = state.get('raw_result')
     prompt = prompt_template_auto.invoke({
         "question": state['question'],
-        "result": state['result']
+        "result": format_result_as_markdown(raw_result, max_tokens=PLOT_CHECK_MAX_TOKENS) if raw_result else state['result']
     })
 
-    parsed = llm.with_structured_output(PlotOption).invoke(prompt)
+    parsed = await llm.with_structured_output(PlotOption).ainvoke(prompt)
     state["wants_plot"] = parsed.wantsPlot
 
     return state
 
 
-def create_plot(state: State):
+async def create_plot(state: State):
     llm = LLMRegistry.get("openai")
 
-    result: list[dict] = state['raw_result']
+    result: ResultTable = state['raw_result']
 
     attempts = state.get("plot_attempts", 0)
     if attempts >= 3:
@@ -54,28 +78,31 @@ def create_plot(state: State):
     if attempts == 0:
         prompt = prompt_template_create.invoke({
             "question": state['question'],
-            "first_25": state['raw_result'][:25],
-            "last_25": state['raw_result'][-25:],
+            "first_25": result.head(25).to_records(),
+            "last_25": result.tail(25).to_records(),
             "num_records": len(result)
         })
     else:
         prompt = prompt_template_create_again.invoke({
             "question": state['question'],
-            "first_25": state['raw_result'][:25],
-            "last_25": state['raw_result'][-25:],
+            "first_25": result.head(25).to_records(),
+            "last_25": result.tail(25).to_records(),
             "number_of_records": len(result),
             "prev_code": state['plot_code'],
             "prev_error": state['plot_error']
         })
 
-    parsed = llm.with_structured_output(PythonOutput).invoke(prompt)
+    parsed = await llm.with_structured_output(PythonOutput).ainvoke(prompt)
     state["plot_code"] = parsed["code"]
     state["plot_attempts"] = attempts + 1
     return state
 
 
 def run_plot_script(state: State) -> State:
-    """Execute LLM-generated Python plot code, replace SAVE_PATH, and store result."""
+    """Execute LLM-generated Python plot code, replace SAVE_PATH, and store result.
+
+    Stays synchronous on purpose: it is CPU-bound, so LangGraph runs it in an executor.
+    """
     filename = f"{uuid.uuid4().hex}.png"
     full_path = PLOT_DIR / filename
 
@@ -94,8 +121,10 @@ def run_plot_script(state: State) -> State:
         "", code
     )
 
+    plt, fm, sns, pd, px, go = load_plot_stack()
+
     try:
-        df = pd.DataFrame(state["raw_result"])
+        df = state["raw_result"].to_dataframe()
     except Exception as e:
         state["plot_error"] = f"Failed to create DataFrame from raw_result: {e}"
         return state
@@ -150,3 +179,26 @@ def run_plot_script(state: State) -> State:
         state["plot_error"] = str(e)
 
     return state
+
+
+PLOT_STATE_KEYS = ["wants_plot", "plot_code", "plot_path", "plot_base64", "plot_error", "plot_attempts"]
+
+
+async def run_plot_pipeline(state: State) -> State:
+    """Run check_if_plot_needed -> create_plot -> run_plot_script outside the graph.
+
+    Mirrors the graph edges (including the retry loop) on a copy of the state, so the
+    answer can be streamed concurrently without both sides mutating the same dict.
+    """
+    plot_state: State = dict(state)
+
+    if plot_state.get("wants_plot") == WantsPlot.AUTO:
+        plot_state = await check_if_plot_needed(plot_state)
+    if plot_state.get("wants_plot") == WantsPlot.NO:
+        return plot_state
+
+    while True:
+        plot_state = await create_plot(plot_state)
+        plot_state = await asyncio.to_thread(run_plot_script, plot_state)
+        if not plot_state.get("plot_error") or plot_state.get("plot_attempts", 0) >= 3:
+            return plot_state
@@ -1,55 +1,50 @@
-from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
+import logging
+from typing import Optional
 
-from langchain import hub
+from analytics_db import AnalyticsDB
+from prompt_store import PromptStore
 from langchain_core.runnables import RunnableLambda
 from langchain_openai import ChatOpenAI
-from database import get_db
+from database import submit_query, submit_guard, QueryCancelled, DB_PATH, get_query_db_path
 from helper.env_loader import load_env
-from helper.result_utils import format_result_as_markdown, split_result
-from helper.sql_aggregations import aggregation_sql_templates
+from helper.query_guard import GUARD_ENABLED
+from helper.result_utils import format_result_chunks
+from helper.sql_compiler import COMPILER_ENABLED, browser_activities, browser_process_list, compile_aggregation_query
+from helper.sql_aggregations import aggregation_sql_templates, rollup_sql_templates, interval_join_sql_templates
 from llm_registry import LLMRegistry
-from schemas import State, QueryOutput, AdjustQueryDecision, TimeGrouping, Activity, TimeFilter, AggregationFeature
+from mirror_db import MIRROR_TABLES
+from schemas import State, QueryBudget, QueryOutput, AdjustQueryDecision, TimeGrouping, TimeFilter, AggregationFeature
 
 load_env()
 
-main_template = hub.pull("sql-query-system-prompt")
+main_template = PromptStore.lazy("sql-query-system-prompt")
 
-diagnostic_template = hub.pull("diagnostic-sql-query")
-predictive_template = hub.pull("predictive-sql-query")
-prescriptive_template = hub.pull("prescriptive-sql-query")
-descriptive_template = hub.pull("descriptive-sql-query")
+diagnostic_template = PromptStore.lazy("diagnostic-sql-query")
+predictive_template = PromptStore.lazy("predictive-sql-query")
+prescriptive_template = PromptStore.lazy("prescriptive-sql-query")
+descriptive_template = PromptStore.lazy("descriptive-sql-query")
 
-ui_template = hub.pull("user_input")
-wa_template = hub.pull("window_activity")
-session_template = hub.pull("session")
+ui_template = PromptStore.lazy("user_input")
+wa_template = PromptStore.lazy("window_activity")
+session_template = PromptStore.lazy("session")
 
-adjust_query_decision_template = hub.pull("adjust-query-decision")
-adjust_query_template = hub.pull("adjust-query")
+adjust_query_decision_template = PromptStore.lazy("adjust-query-decision")
+adjust_query_template = PromptStore.lazy("adjust-query")
 
-correct_query_template = hub.pull("correct-query")
+correct_query_template = PromptStore.lazy("correct-query")
 
 aggregation_template_map = {
     item["feature"]: item["sql_template"]
     for item in aggregation_sql_templates
 }
-
-browser_activities = {
-    Activity.WorkRelatedBrowsing,
-    Activity.WorkUnrelatedBrowsing
+rollup_template_map = {
+    item["feature"]: item["sql_template"]
+    for item in rollup_sql_templates
+}
+interval_join_template_map = {
+    item["feature"]: item["sql_template"]
+    for item in interval_join_sql_templates
 }
-browser_process_list = [
-    "Brave Browser",
-    "Firefox",
-    "Microsoft Edge",
-    "Google Chrome",
-    "Safari",
-    "Opera",
-    "Opera GX",
-    "Chromium",
-    "Vivaldi",
-    "Tor Browser",
-]
-
 
 def get_custom_table_info(state: State) -> str:
     prompt_parts = []
@@ -82,10 +77,18 @@ def get_custom_table_info(state: State) -> str:
         elif table == "session":
             prompt_parts.append(session_template.messages[0].prompt.template)
 
+    epoch_tables = [table for table in tables if table in MIRROR_TABLES]
+    if epoch_tables and get_query_db_path() != DB_PATH:
+        prompt_parts.append(
+            f"The tables {', '.join(f'`{table}`' for table in epoch_tables)} also have the integer columns "
+            "`tsStartEpoch` and `tsEndEpoch` (Unix epoch seconds of `tsStart` and `tsEnd`). "
+            "Use them instead of strftime('%s', ...) when computing durations or gaps."
+        )
+
     return "\n\n---\n\n".join(prompt_parts)
 
 
-def check_query_adjustment(state: State) -> State:
+async def check_query_adjustment(state: State) -> State:
     llm = LLMRegistry.get("openai")
 
     prompt = adjust_query_decision_template.invoke({
@@ -93,7 +96,7 @@ def check_query_adjustment(state: State) -> State:
         "last_query": state["last_query"]
     })
 
-    parsed = llm.with_structured_output(AdjustQueryDecision).invoke(prompt)
+    parsed = await llm.with_structured_output(AdjustQueryDecision).ainvoke(prompt)
     state["adjust_query"] = parsed.adjust
     return state
 
@@ -119,15 +122,59 @@ def get_time_filter_prompt(tf: TimeFilter):
     return "No time filter applicable."
 
 
+def aggregation_template(feature: Optional[AggregationFeature]) -> tuple[Optional[str], Optional[str]]:
+    """The template for a feature and its kind: "rollup", "interval_map" or "raw"."""
+    if feature in rollup_template_map and AnalyticsDB.is_ready():
+        return "rollup", rollup_template_map[feature]
+    if feature in interval_join_template_map and AnalyticsDB.is_ready():
+        return "interval_map", interval_join_template_map[feature]
+    if feature:
+        return "raw", aggregation_template_map[feature]
+    return None, None
+
+
+def compile_query(state: State) -> Optional[str]:
+    """SQL for a recognized aggregation feature, or None if the LLM has to write it."""
+    if not COMPILER_ENABLED or state.get("aggregation_feature") is None:
+        return None
+    feature = state["aggregation_feature"]
+    source, sql_template = aggregation_template(feature)
+    return compile_aggregation_query(
+        sql_template,
+        source,
+        feature,
+        state.get("time_grouping"),
+        state.get("time_filter"),
+        state.get("activities") if "window_activity" in state.get("tables", []) else None
+    )
+
+
 def query_chain(llm: ChatOpenAI):
     def select_template(state: State):
         insight_mode = state.get('insight_mode', "descriptive")
         feature: AggregationFeature = state.get("aggregation_feature")
 
-        if feature:
+        source, sql_template = aggregation_template(feature)
+        if source == "rollup":
+            aggregation_hint = (
+                    "- Use the following aggregation SQL template to help write your query:\n\n"
+                    + f"-- Feature: {feature.name}\n{sql_template}"
+                    + "\n\nThe table is an hourly rollup: use its `hour` column (format 'YYYY-MM-DD HH:00:00') "
+                      "wherever you would use `tsStart` for time grouping and time filters."
+                    + "\n\nUse an appropriate column alias for the `{time_bucket}` (e.g., if time grouping is hours, name the column `hour`; if days, name it `day`, etc.)."
+            )
+        elif source == "interval_map":
             aggregation_hint = (
                     "- Use the following aggregation SQL template to help write your query:\n\n"
-                    + f"-- Feature: {feature.name}\n{aggregation_template_map[feature]}"
+                    + f"-- Feature: {feature.name}\n{sql_template}"
+                    + "\n\nThe analytics.*_map tables assign every row to its enclosing window_activity and session; "
+                      "join through them on ids instead of comparing tsStart ranges."
+                    + "\n\nUse an appropriate column alias for the `{time_bucket}` (e.g., if time grouping is hours, name the column `hour`; if days, name it `day`, etc.)."
+            )
+        elif source:
+            aggregation_hint = (
+                    "- Use the following aggregation SQL template to help write your query:\n\n"
+                    + f"-- Feature: {feature.name}\n{sql_template}"
                     + "\n\nUse an appropriate column alias for the `{time_bucket}` (e.g., if time grouping is hours, name the column `hour`; if days, name it `day`, etc.)."
             )
         else:
@@ -162,59 +209,89 @@ def query_chain(llm: ChatOpenAI):
     )
 
 
-def write_query(state: State) -> State:
+async def write_query(state: State) -> State:
     """For LangGraph Orchestration"""
+    if state.get("query_error"):
+        # Bounced back by check_query
+        state["query"] = await correct_query(
+            state["query"],
+            f"The query was rejected before execution: {state['query_error']} "
+            "Rewrite it so that it answers the same question with a cheaper plan."
+        )
+        return state
     if not state["adjust_query"] and state["branch"] == "follow_up":
         state["query"] = state["last_query"]
         return state
-    llm = LLMRegistry.get("openai")
-    query = query_chain(llm).invoke(state)
+    if state.get("aggregation_feature") in rollup_template_map | interval_join_template_map:
+        # Incremental, and skipped entirely when the tracker has not written since the last refresh
+        await AnalyticsDB.refresh_async()
+    query = compile_query(state)
+    if query is not None:
+        logging.info(f"[write_query] Compiled {state['aggregation_feature'].name} query without the LLM")
+    else:
+        llm = LLMRegistry.get("openai")
+        query = await query_chain(llm).ainvoke(state)
     state['query'] = query
     return state
 
 
-def execute_query(state: State) -> State:
-    def run_query():
-        db = get_db()
-        raw_result = db._execute(state["query"])
-        return raw_result
-
-    with ThreadPoolExecutor(max_workers=1) as executor:
-        future = executor.submit(run_query)
-        try:
-            # Wait up to 180 seconds
-            raw_result = future.result(timeout=180)
-            chunks = split_result(raw_result)
-            state["raw_result"] = raw_result
-            state["result"] = [format_result_as_markdown(chunk) for chunk in chunks]
-        except FuturesTimeoutError:
-            state["result"] = ["Query execution exceeded 3 minutes and was aborted."]
-        except Exception as e:
-            state["result"] = [f"Query execution failed: {str(e)}"]
+async def check_query(state: State) -> State:
+    """Estimate the cost of the query from its plan and run, rewrite or bounce it; see helper.query_guard."""
+    state["query_error"] = None
+    if not GUARD_ENABLED:
+        return state
+    try:
+        verdict = await submit_guard(state["query"], state.get("time_filter"), state.get("top_k"))
+    except Exception as e:
+        logging.warning(f"[check_query] Skipping the plan check: {e}")
+        return state
+    if verdict.action == "rewrite":
+        logging.info(f"[check_query] {verdict.reason}")
+        state["query"] = verdict.query
+    elif verdict.action == "reject":
+        logging.info(f"[check_query] Rejected: {verdict.reason}")
+        reason = verdict.reason
+        if verdict.range_join and AnalyticsDB.is_ready():
+            reason += (" Join user_input and window_activity to their enclosing window_activity and session through "
+                       "analytics.user_input_interval_map and analytics.window_activity_session_map on ids.")
+        state["query_error"] = reason
+        state["query_attempts"] = state.get("query_attempts", 0) + 1
+    return state
+
+
+async def execute_query(state: State) -> State:
+    if state.get("query_error"):
+        state["raw_result"] = None
+        state["result"] = [f"Query was not executed: {state['query_error']}"]
+        return state
+    budget = state.get("query_budget") or QueryBudget()
+    try:
+        raw_result, truncated = await submit_query(state["query"], budget)
+        state["raw_result"] = raw_result
+        state["result"] = format_result_chunks(raw_result)
+        if truncated:
+            state["result"].append(f"Note: the result was limited to the first {budget.max_rows} rows.")
+    except (QueryCancelled, TimeoutError) as e:
+        state["result"] = [str(e) or "Query execution exceeded its time budget and was aborted."]
+    except Exception as e:
+        state["result"] = [f"Query execution failed: {str(e)}"]
     return state
 
 
-def correct_query(query, instructions):
+async def correct_query(query, instructions):
     llm = LLMRegistry.get("openai-mini")
     prompt = correct_query_template.invoke({"instruction": instructions,
                                             "query": query})
-    parsed = llm.with_structured_output(QueryOutput).invoke(prompt)
+    parsed = await llm.with_structured_output(QueryOutput).ainvoke(prompt)
 
     return parsed["query"]
 
 
-def execute_corrected_query(query):
-    def run_query():
-        db = get_db()
-        return db._execute(query)
-
-    with ThreadPoolExecutor(max_workers=1) as executor:
-        future = executor.submit(run_query)
-        try:
-            # Wait up to 3 minutes (180 seconds)
-            result = future.result(timeout=180)
-            return result
-        except FuturesTimeoutError:
-            return {"error": "Query execution exceeded 3 minutes and was aborted."}
-        except Exception as e:
-            return {"error": f"Query execution failed: {str(e)}"}
+async def execute_corrected_query(query, budget: QueryBudget = None):
+    try:
+        result, _ = await submit_query(query, budget)
+        return result.to_json()
+    except (QueryCancelled, TimeoutError) as e:
+        return {"error": str(e) or "Query execution exceeded its time budget and was aborted."}
+    except Exception as e:
+        return {"error": f"Query execution failed: {str(e)}"}
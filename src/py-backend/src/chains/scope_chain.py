@@ -1,4 +1,4 @@
-from langchain import hub
+from prompt_store import PromptStore
 from langchain_core.output_parsers.openai_tools import PydanticToolsParser
 from langchain_core.runnables import RunnableSequence
 from langchain_openai import ChatOpenAI
@@ -9,7 +9,7 @@ from schemas import State, QueryScope
 
 load_env()
 output_parser = PydanticToolsParser(tools=[QueryScope])
-prompt_template = hub.pull("get_scope")
+prompt_template = PromptStore.lazy("get_scope")
 
 
 def scope_chain(llm: ChatOpenAI) -> RunnableSequence[State, list[str]]:
@@ -19,7 +19,7 @@ def scope_chain(llm: ChatOpenAI) -> RunnableSequence[State, list[str]]:
             | output_parser
     )
 
-def get_scope(state: State) -> State:
+async def get_scope(state: State) -> State:
     llm = LLMRegistry.get("openai")
 
     prompt = prompt_template.invoke({
@@ -28,7 +28,7 @@ def get_scope(state: State) -> State:
         "current_time": state['current_time']
     })
 
-    parsed = llm.with_structured_output(QueryScope).invoke(prompt)
+    parsed = await llm.with_structured_output(QueryScope).ainvoke(prompt)
     state["aggregation_feature"] = parsed.aggregationFeature
     state["time_grouping"] = parsed.timeGrouping
     state["time_filter"] = parsed.timeFilter
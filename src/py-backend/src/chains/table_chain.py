@@ -1,4 +1,4 @@
-from langchain import hub
+from prompt_store import PromptStore
 from langchain_core.output_parsers.openai_tools import PydanticToolsParser
 from langchain_core.runnables import RunnableSequence
 from langchain_openai import ChatOpenAI
@@ -9,7 +9,7 @@ from schemas import Table, State
 
 load_env()
 output_parser = PydanticToolsParser(tools=[Table])
-prompt_template = hub.pull("get_relevant_tables")
+prompt_template = PromptStore.lazy("get_relevant_tables")
 
 
 def table_chain(llm: ChatOpenAI) -> RunnableSequence[State, list[str]]:
@@ -21,11 +21,11 @@ def table_chain(llm: ChatOpenAI) -> RunnableSequence[State, list[str]]:
     )
 
 
-def get_tables(state: State) -> State:
+async def get_tables(state: State) -> State:
     """For LangGraph Orchestration"""
     if not state["adjust_query"] and state["branch"] == "follow_up":
         return state
     llm = LLMRegistry.get("openai")
-    tables = table_chain(llm).invoke(state)
+    tables = await table_chain(llm).ainvoke(state)
     state['tables'] = tables
     return state
@@ -0,0 +1,66 @@
+import asyncio
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import Any, AsyncIterator, Iterable
+
+import aiosqlite
+
+
+class ChatDB:
+    """Single long-lived connection for chat metadata stored in the checkpoint database.
+
+    Opened once in chat_engine.initialize(). Statements are reused through the sqlite3
+    statement cache of the connection, and writes are serialized so that concurrent
+    chats never commit each other's half-finished transactions.
+    """
+    _conn: aiosqlite.Connection | None = None
+    _write_lock: asyncio.Lock | None = None
+
+    @classmethod
+    async def open(cls, path: Path):
+        if cls._conn is not None:
+            return
+        path.parent.mkdir(parents=True, exist_ok=True)
+        cls._conn = await aiosqlite.connect(str(path), cached_statements=256)
+        await cls._conn.execute("PRAGMA journal_mode=WAL")
+        await cls._conn.execute("PRAGMA synchronous=NORMAL")
+        cls._write_lock = asyncio.Lock()
+
+    @classmethod
+    async def close(cls):
+        if cls._conn is not None:
+            await cls._conn.close()
+            cls._conn = None
+
+    @classmethod
+    def connection(cls) -> aiosqlite.Connection:
+        if cls._conn is None:
+            raise RuntimeError("ChatDB is not open. Call ChatDB.open() in initialize() first.")
+        return cls._conn
+
+    @classmethod
+    @asynccontextmanager
+    async def transaction(cls) -> AsyncIterator[aiosqlite.Connection]:
+        conn = cls.connection()
+        async with cls._write_lock:
+            try:
+                yield conn
+                await conn.commit()
+            except BaseException:
+                await conn.rollback()
+                raise
+
+    @classmethod
+    async def execute(cls, sql: str, params: Iterable[Any] = ()):
+        async with cls.transaction() as conn:
+            await conn.execute(sql, params)
+
+    @classmethod
+    async def fetchone(cls, sql: str, params: Iterable[Any] = ()):
+        async with cls.connection().execute(sql, params) as cursor:
+            return await cursor.fetchone()
+
+    @classmethod
+    async def fetchall(cls, sql: str, params: Iterable[Any] = ()) -> list:
+        async with cls.connection().execute(sql, params) as cursor:
+            return await cursor.fetchall()
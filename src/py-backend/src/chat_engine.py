@@ -1,7 +1,6 @@
 import asyncio
 import logging
 import os
-import sqlite3
 import sys
 import uuid
 
@@ -17,20 +16,24 @@ from langgraph.graph import START, END, StateGraph
 from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
 from langgraph.graph.graph import CompiledGraph
 
-from chains.activity_chain import extract_activities
+from blob_store import resolve_message_meta, PAYLOAD_FIELDS
 from chains.answer_chain import generate_answer, general_answer
+from chains.plan_chain import plan_query
 from chains.plot_chain import check_if_plot_needed, create_plot, run_plot_script
-from chains.query_chain import write_query, execute_query, check_query_adjustment
-from chains.scope_chain import get_scope
-from chains.table_chain import get_tables
+from chains.query_chain import write_query, check_query, execute_query, check_query_adjustment
 from chains.init_chain import classify_question, generate_title
 from chains.context_chain import give_context
-from database import get_chat_db_path, migrate_checkpoint_db
-from helper.chat_utils import title_exists, give_correct_step
+from chat_db import ChatDB
+from database import get_chat_db_path, migrate_checkpoint_db, submit_query
+from helper.checkpoint_utils import compact_checkpoints
+from helper.chat_utils import title_exists, give_correct_step, backfill_chat_metadata, seed_thread_id_sequence
 from helper.env_loader import load_env
-from helper.result_utils import format_result_as_markdown
-from schemas import State, WantsPlot, AnswerDetail
+from helper.query_guard import route_checked_query
+from helper.result_utils import format_result_chunks, stream_result
+from schemas import State, WantsPlot, AnswerDetail, QueryBudget
 from llm_registry import LLMRegistry
+from prompt_store import PromptStore
+from result_table import ResultTable
 
 load_env()
 APPDATA_PATH = Path(os.getenv("APPDATA", Path.home()))
@@ -40,12 +43,13 @@ CHECKPOINT_DB_PATH = get_chat_db_path()
 
 graph: CompiledGraph
 checkpointer: AsyncSqliteSaver
+compaction_task: asyncio.Task | None = None
 
 logging.basicConfig(level=logging.INFO)
 
 
 async def initialize():
-    global graph, checkpointer
+    global graph, checkpointer, compaction_task
 
     llm_openai = ChatOpenAI(
         model="gpt-4o",
@@ -72,11 +76,16 @@ async def initialize():
     LLMRegistry.register("openai-high-temp", llm_openai_high_temp)
     LLMRegistry.register("openai-mini", llm_openai_mini)
 
+    # Prompts are served from the local bundle; pick up hub changes for the next start
+    if os.getenv("PQ_PROMPT_REFRESH", "1") == "1":
+        PromptStore.refresh_in_background()
+
     # FIXME TEMPORARY MIGRATION
     if sys.platform == "darwin":
         migrate_checkpoint_db(OLD_CHECKPOINT_DB_PATH, CHECKPOINT_DB_PATH)
 
-    async with aiosqlite.connect(str(CHECKPOINT_DB_PATH)) as setup_conn:
+    await ChatDB.open(CHECKPOINT_DB_PATH)
+    async with ChatDB.transaction() as setup_conn:
         await setup_conn.execute("""
             CREATE TABLE IF NOT EXISTS chat_metadata (
                 thread_id TEXT PRIMARY KEY,
@@ -97,7 +106,18 @@ async def initialize():
                 created_at TEXT
             )
         """)
-        await setup_conn.commit()
+        await setup_conn.execute("""
+            CREATE INDEX IF NOT EXISTS idx_chat_metadata_last_activity
+            ON chat_metadata (last_activity DESC, thread_id DESC)
+        """)
+        await setup_conn.execute("""
+            CREATE TABLE IF NOT EXISTS app_state (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            )
+        """)
+    await backfill_chat_metadata()
+    await seed_thread_id_sequence()
 
     # Then, create a separate connection just for the checkpointer
     saver_conn = await aiosqlite.connect(str(CHECKPOINT_DB_PATH))
@@ -111,12 +131,19 @@ async def initialize():
     graph_builder.add_edge(START, "classify_question")
 
     graph_builder.add_sequence([
-        get_tables,
-        extract_activities,
-        get_scope,
+        plan_query,
         write_query,
-        execute_query,
+        check_query,
     ])
+    graph_builder.add_node("execute_query", execute_query)
+    graph_builder.add_conditional_edges(
+        "check_query",
+        route_checked_query,
+        {
+            "write_query": "write_query",
+            "execute_query": "execute_query"
+        }
+    )
 
     graph_builder.add_node("general_answer", general_answer)
     graph_builder.add_edge("general_answer", END)
@@ -131,11 +158,11 @@ async def initialize():
     graph_builder.add_conditional_edges(
         "give_context",
         lambda s: (
-            "get_tables" if s["branch"] == "data_query"
+            "plan_query" if s["branch"] == "data_query"
             else "check_query_adjustment"
         ),
         {
-            "get_tables": "get_tables",
+            "plan_query": "plan_query",
             "check_query_adjustment": "check_query_adjustment"
         }
     )
@@ -157,7 +184,8 @@ async def initialize():
     graph_builder.add_conditional_edges(
         "execute_query",
         lambda s: (
-            "create_plot" if s.get("wants_plot") == WantsPlot.YES
+            "generate_answer" if s.get("parallel_plot")
+            else "create_plot" if s.get("wants_plot") == WantsPlot.YES
             else "check_if_plot_needed" if s.get("wants_plot") == WantsPlot.AUTO
             else "generate_answer"
         ),
@@ -195,11 +223,38 @@ async def initialize():
         }
     )
 
-    graph_builder.add_edge("check_query_adjustment", "get_tables")
+    graph_builder.add_edge("check_query_adjustment", "plan_query")
     graph_builder.add_edge("generate_title", "give_context")
 
     graph = graph_builder.compile(checkpointer=checkpointer)
 
+    if os.getenv("PQ_COMPACT_ON_STARTUP", "1") == "1":
+        compaction_task = asyncio.create_task(compact_checkpoints())
+
+
+async def shutdown():
+    """Stop the startup compaction if it is still running and close the connections opened in initialize()."""
+    if compaction_task:
+        compaction_task.cancel()
+        await asyncio.gather(compaction_task, return_exceptions=True)
+    await checkpointer.conn.close()
+    await ChatDB.close()
+
+
+async def serialize_ai_message(msg: AIMessage, exclude_meta: set[str] = frozenset()) -> Dict:
+    """Client representation of an answer, with blob references in its meta resolved."""
+    additional_kwargs = dict(msg.additional_kwargs)
+    if "meta" in additional_kwargs:
+        additional_kwargs["meta"] = await asyncio.to_thread(
+            resolve_message_meta, additional_kwargs["meta"], exclude_meta
+        )
+    return {
+        "id": msg.id,
+        "role": "ai",
+        "content": msg.content,
+        "additional_kwargs": additional_kwargs
+    }
+
 
 async def run_chat(question: str,
                    chat_id: str,
@@ -207,17 +262,17 @@ async def run_chat(question: str,
                    auto_approve=False,
                    answer_detail=AnswerDetail.AUTO,
                    wants_plot=WantsPlot.AUTO,
-                   websocket=None) -> Dict:
+                   parallel_plot=False,
+                   websocket=None,
+                   query_budget: QueryBudget = None) -> Dict:
     """Main chat execution."""
     now = datetime.now(UTC).isoformat()
     try:
-        async with aiosqlite.connect(str(CHECKPOINT_DB_PATH)) as conn:
-            await conn.execute("""
-                    INSERT INTO chat_metadata (thread_id, last_activity)
-                    VALUES (?, ?)
-                    ON CONFLICT(thread_id) DO UPDATE SET last_activity = excluded.last_activity
-                """, (chat_id, now))
-            await conn.commit()
+        await ChatDB.execute("""
+                INSERT INTO chat_metadata (thread_id, last_activity)
+                VALUES (?, ?)
+                ON CONFLICT(thread_id) DO UPDATE SET last_activity = excluded.last_activity
+            """, (chat_id, now))
     except Exception as e:
         print(f"[update_last_activity] Failed to update chat '{chat_id}': {e}")
 
@@ -252,10 +307,13 @@ async def run_chat(question: str,
         "tables": [],
         "activities": [],
         "query": "",
-        "raw_result": "",
+        "query_error": None,
+        "query_attempts": 0,
+        "raw_result": None,
         "result": [],
         "answer": "",
         "top_k": top_k,
+        "query_budget": query_budget,
         "last_query": await get_last_query(chat_id),
         "adjust_query": False,
         "wants_plot": wants_plot,
@@ -265,7 +323,8 @@ async def run_chat(question: str,
         "plot_code": None,
         "plot_path": None,
         "plot_base64": None,
-        "plot_attempts": 0
+        "plot_attempts": 0,
+        "parallel_plot": parallel_plot
     }
 
     messages.append(HumanMessage(content=question))
@@ -281,10 +340,10 @@ async def run_chat(question: str,
     try:
         async for step in graph.astream(state, config, stream_mode="updates", interrupt_after=interrupt_nodes):
             node_name = list(step.keys())[0]
-            if node_name == "write_query":
+            if node_name in ("write_query", "check_query"):
                 query = step[node_name].get("query")
             if node_name == "execute_query":
-                data = step[node_name].get("raw_result")
+                data = step[node_name].get("raw_result") or ResultTable.empty()
             if node_name != "__interrupt__":
                 step_state = step[node_name]
                 branch = step_state.get("branch")
@@ -301,11 +360,7 @@ async def run_chat(question: str,
         return {"error": "resume failed"}
 
     answer = state['messages'][-1]
-    final_msg = {"id": answer.id,
-                 "role": "ai",
-                 "content": answer.content,
-                 "additional_kwargs": answer.additional_kwargs
-                 }
+    final_msg = await serialize_ai_message(answer)
     if branch != "general_qa" and (not auto_approve or not auto_sql):
         if len(data) > 0:
             if websocket:
@@ -313,12 +368,15 @@ async def run_chat(question: str,
                     "type": "interruption",
                     "reason": {"auto_sql": auto_sql, "auto_approve": auto_approve},
                     "query": query,
-                    "data": data,
+                    "columns": data.columns,
+                    "row_count": len(data),
                     "chat_id": chat_id
                 })
+                await stream_result(websocket, data)
                 return {}
         else:
-            await resume_stream(chat_id, [], websocket)
+            # None keeps the result execute_query stored, e.g. the reason a query was not executed
+            await resume_stream(chat_id, None, websocket)
             return {}
 
     return final_msg
@@ -327,9 +385,14 @@ async def run_chat(question: str,
 async def resume_stream(chat_id: str, data, websocket) -> Dict:
     config = {"configurable": {"thread_id": chat_id, "websocket": websocket}}
     final_msg = {}
-    await graph.aupdate_state(config, {'raw_result': data, 'result': [format_result_as_markdown(data)]})
+    if data is not None:
+        # Clients that received the result as a stream approve it without posting it back
+        data = ResultTable.from_records(data)
+        await graph.aupdate_state(config, {'raw_result': data, 'result': format_result_chunks(data)})
     state = await graph.aget_state(config)
-    if state.values.get("wants_plot") == WantsPlot.AUTO:
+    if state.values.get("parallel_plot"):
+        current_step = "generate answer"
+    elif state.values.get("wants_plot") == WantsPlot.AUTO:
         current_step = "check if plot needed"
     elif state.values.get("wants_plot") == WantsPlot.YES:
         current_step = "create plot"
@@ -346,12 +409,7 @@ async def resume_stream(chat_id: str, data, websocket) -> Dict:
             await asyncio.sleep(0)
             if node_name == 'generate_answer':
                 answer = step_state.get("messages")[-1]
-                final_msg = {
-                    "id": answer.id,
-                    "role": "ai",
-                    "content": answer.content,
-                    "additional_kwargs": answer.additional_kwargs
-                }
+                final_msg = await serialize_ai_message(answer)
         await websocket.send_json(final_msg)
     except Exception as e:
         logging.error(f"[resume_stream (approval)] Failed for chat_id={chat_id}: {e}")
@@ -364,9 +422,23 @@ async def resume_stream(chat_id: str, data, websocket) -> Dict:
 
 async def update_sql_data(chat_id: str, query, data, websocket):
     config = {"configurable": {"thread_id": chat_id, "websocket": websocket}}
+    if data is None:
+        try:
+            # Re-executing is served from the query result cache when the query already ran
+            data, _ = await submit_query(query)
+        except Exception as e:
+            logging.error(f"[update_sql_data] Query failed for chat_id={chat_id}: {e}")
+            if websocket:
+                await websocket.send_json({
+                    "type": "error",
+                    "message": str(e)
+                })
+            return {"error": "query failed"}
+    else:
+        data = ResultTable.from_records(data)
     await graph.aupdate_state(config, {'query': query,
                                        'raw_result': data,
-                                       'result': [format_result_as_markdown(data)]})
+                                       'result': format_result_chunks(data)})
     final_msg = {}
     state = await graph.aget_state(config)
     auto_approve = state.values.get('auto_approve')
@@ -380,12 +452,7 @@ async def update_sql_data(chat_id: str, query, data, websocket):
             await asyncio.sleep(0)
             if node_name == 'generate_answer':
                 answer = step_state.get("messages")[-1]
-                final_msg = {
-                    "id": answer.id,
-                    "role": "ai",
-                    "content": answer.content,
-                    "additional_kwargs": answer.additional_kwargs
-                }
+                final_msg = await serialize_ai_message(answer)
         await websocket.send_json(final_msg)
     except Exception as e:
         logging.error(f"[resume_stream (sql)] Failed for chat_id={chat_id}: {e}")
@@ -396,24 +463,65 @@ async def update_sql_data(chat_id: str, query, data, websocket):
         return {"error": "resume failed"}
 
 
-async def get_chat_history(chat_id: str) -> Dict:
+async def get_chat_history(chat_id: str,
+                           before: int | None = None,
+                           limit: int | None = None,
+                           exclude: list[str] | None = None) -> Dict:
+    """Return a window of a chat's messages, oldest first.
+
+    `before` is the index of the first message of the previous window (its `next_before`)
+    and `limit` the window size. `exclude` lists fields to leave out, e.g. "meta.result" or
+    "meta.plotBase64"; those can be loaded per message with get_message_payload.
+    """
     config = {"configurable": {"thread_id": chat_id}}
     try:
         snapshot = await graph.aget_state(config)
         messages = snapshot.values.get("messages", [])
     except Exception:
         return {"error": "Chat not found"}
+
+    exclude = exclude or []
+    exclude_meta = {field.removeprefix("meta.") for field in exclude if field.startswith("meta.")}
+    exclude_top = {field for field in exclude if not field.startswith("meta.")}
+
+    end = len(messages) if before is None else max(0, min(before, len(messages)))
+    start = 0 if limit is None else max(0, end - limit)
+
     result = []
-    for msg in messages:
+    for index in range(start, end):
+        msg = messages[index]
         if isinstance(msg, HumanMessage):
-            result.append({"role": "human", "content": msg.content})
+            entry = {"role": "human", "content": msg.content}
         elif isinstance(msg, AIMessage):
-            result.append(
-                {"role": "ai", "content": msg.content, "additional_kwargs": msg.additional_kwargs, "id": msg.id})
+            entry = await serialize_ai_message(msg, exclude_meta)
         elif isinstance(msg, SystemMessage):
-            result.append({"role": "system", "content": msg.content})
+            entry = {"role": "system", "content": msg.content}
+        else:
+            continue
+        entry["index"] = index
+        result.append({key: value for key, value in entry.items() if key not in exclude_top})
+
+    return {"messages": result, "next_before": start if start > 0 else None, "total": len(messages)}
+
+
+async def get_message_payload(chat_id: str, message_id: str, fields: list[str] | None = None) -> Dict:
+    """Load the result rows and/or plot image of a single answer."""
+    config = {"configurable": {"thread_id": chat_id}}
+    try:
+        snapshot = await graph.aget_state(config)
+        messages = snapshot.values.get("messages", [])
+    except Exception:
+        return {"error": "Chat not found"}
 
-    return {"messages": result}
+    msg = next((m for m in messages if isinstance(m, AIMessage) and m.id == message_id), None)
+    if msg is None:
+        return {"error": "Message not found."}
+
+    fields = set(fields or PAYLOAD_FIELDS) & PAYLOAD_FIELDS
+    meta = await asyncio.to_thread(
+        resolve_message_meta, msg.additional_kwargs.get("meta", {}), PAYLOAD_FIELDS - fields
+    )
+    return {field: meta.get(field) for field in fields}
 
 
 async def get_last_query(chat_id: str):
@@ -435,11 +543,10 @@ async def get_last_query(chat_id: str):
 
 async def delete_chat(chat_id: str):
     try:
-        async with aiosqlite.connect(str(CHECKPOINT_DB_PATH)) as conn:
+        async with ChatDB.transaction() as conn:
             await conn.execute("DELETE FROM checkpoints WHERE thread_id = ?", (chat_id,))
             await conn.execute("DELETE FROM writes WHERE thread_id = ?", (chat_id,))
             await conn.execute("DELETE FROM chat_metadata WHERE thread_id = ?", (chat_id,))
-            await conn.commit()
 
         return {"status": "Chat successfully deleted"}
     except Exception as e:
@@ -448,13 +555,11 @@ async def delete_chat(chat_id: str):
 
 async def rename_chat(chat_id: str, new_title: str):
     try:
-        async with aiosqlite.connect(str(CHECKPOINT_DB_PATH)) as conn:
-            await conn.execute("""
-                UPDATE chat_metadata
-                SET title = ?
-                WHERE thread_id = ?
-            """, (new_title.strip(), chat_id))
-            await conn.commit()
+        await ChatDB.execute("""
+            UPDATE chat_metadata
+            SET title = ?
+            WHERE thread_id = ?
+        """, (new_title.strip(), chat_id))
 
         return {"status": f"Chat title updated to '{new_title.strip()}'"}
     except Exception as e:
@@ -483,16 +588,13 @@ async def store_feedback(chat_id, msg_id, data_correct, question_answered, comme
     created_at = datetime.now(UTC).isoformat()
     content = targetted_msg.content
 
-    conn = sqlite3.connect(str(CHECKPOINT_DB_PATH), check_same_thread=False)
-    cursor = conn.cursor()
-
     meta = targetted_msg.additional_kwargs.get("meta", {})
     meta["fbSubmitted"] = True
     targetted_msg.additional_kwargs["meta"] = meta
 
     await graph.aupdate_state(config, {'messages': messages})
 
-    cursor.execute("""
+    await ChatDB.execute("""
             INSERT INTO feedback (
                 id, thread_id, message_id, question, message_content,
                 data_correct, question_answered, comment, created_at
@@ -510,7 +612,4 @@ async def store_feedback(chat_id, msg_id, data_correct, question_answered, comme
         created_at
     ))
 
-    conn.commit()
-    conn.close()
-
     return {"status": "success", "feedback_id": feedback_id}
@@ -1,14 +1,24 @@
+import asyncio
+import logging
 import shutil
-import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 from langchain_community.utilities import SQLDatabase
 from sqlalchemy import create_engine
-from sqlalchemy.pool import StaticPool
+from sqlalchemy.pool import SingletonThreadPool
 import sqlite3
 import os
 from pathlib import Path
 
 from helper.env_loader import load_env
+from helper.query_cache import QueryResultCache
+from helper.query_guard import QueryVerdict, TableStats, analyze_query
+from mirror_db import MirrorDB
+from paths import get_app_data_dir
+from result_table import ResultTable
+from schemas import QueryBudget, TimeFilter
 
 load_env()
 
@@ -21,6 +31,56 @@ DB_PATH.parent.mkdir(parents=True, exist_ok=True)
 _engine = None
 _db_instance = None
 
+POOL_SIZE = int(os.getenv("PQ_SQLITE_POOL_SIZE", "8"))
+MMAP_SIZE = int(float(os.getenv("PQ_SQLITE_MMAP_MB", "256")) * 1024 * 1024)
+CACHE_SIZE_KIB = int(float(os.getenv("PQ_SQLITE_CACHE_MB", "64")) * 1024)
+
+# Long-lived workers keep their pooled connection (and its page cache) across queries
+query_executor = ThreadPoolExecutor(max_workers=POOL_SIZE, thread_name_prefix="sql-query")
+# Number of SQLite VM instructions between two budget checks
+PROGRESS_INTERVAL = 1000
+_result_cache = QueryResultCache(max_bytes=int(float(os.getenv("PQ_SQL_CACHE_MAX_MB", "64")) * 1024 * 1024))
+# Serve reads from an indexed local copy instead of the tracker's database
+MIRROR_ENABLED = os.getenv("PQ_MIRROR") == "1"
+_mirror = MirrorDB(DB_PATH, get_app_data_dir() / "pa_mirror.db",
+                   min_interval_seconds=float(os.getenv("PQ_MIRROR_SYNC_SECONDS", "30")))
+
+
+def get_query_db_path() -> Path:
+    """The database queries run on: the mirror once it exists in mirror mode, else the tracker's."""
+    if MIRROR_ENABLED and _mirror.path.exists():
+        return _mirror.path
+    return DB_PATH
+
+
+def sync_mirror():
+    """Bring the mirror up to date before a query in mirror mode; failures fall back to the tracker's database."""
+    if not MIRROR_ENABLED:
+        return
+    try:
+        _mirror.sync(get_file_version(DB_PATH))
+    except Exception as e:
+        logging.warning(f"[sync_mirror] Mirror sync failed: {e}")
+
+
+def connect_readonly() -> sqlite3.Connection:
+    """Open a tuned read-only connection to the PersonalAnalytics database (or its mirror)."""
+    conn = sqlite3.connect(
+        f"file:{get_query_db_path()}?mode=ro",
+        uri=True,
+        check_same_thread=False
+    )
+    conn.execute("PRAGMA query_only = ON")
+    conn.execute(f"PRAGMA mmap_size = {MMAP_SIZE}")
+    # Negative values are interpreted as KiB instead of pages
+    conn.execute(f"PRAGMA cache_size = -{CACHE_SIZE_KIB}")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    analytics_path = get_analytics_db_path()
+    if analytics_path.exists():
+        # Rollups and other derived tables, see analytics_db.AnalyticsDB
+        conn.execute("ATTACH DATABASE ? AS analytics", (f"file:{analytics_path}?mode=ro",))
+    return conn
+
 
 def get_db():
     global _engine, _db_instance
@@ -29,22 +89,222 @@ def get_db():
         if not DB_PATH.exists():
             raise FileNotFoundError("PersonalQuery database does not exist.")
 
-        readonly_connection = sqlite3.connect(
-            f"file:{DB_PATH}?mode=ro",
-            uri=True,
-            check_same_thread=False
-        )
+        # One connection per worker thread, so queries from different chats run in parallel
         _engine = create_engine(
             "sqlite://",
-            creator=lambda: readonly_connection,
-            poolclass=StaticPool,
-            connect_args={"check_same_thread": False},
+            creator=connect_readonly,
+            poolclass=SingletonThreadPool,
+            pool_size=POOL_SIZE,
         )
         _db_instance = SQLDatabase(_engine)
 
     return _db_instance
 
 
+def checkout_connection():
+    """Check out this thread's pooled connection to the database queries run on.
+
+    A connection opened on another database, e.g. on the tracker's before the mirror
+    existed, is reopened; connections of other threads are left alone while they run.
+    """
+    get_db()
+    pooled = _engine.raw_connection()
+    main_path = pooled.driver_connection.execute("PRAGMA database_list").fetchone()[2]
+    if Path(main_path).resolve() != get_query_db_path().resolve():
+        pooled.invalidate()
+        pooled = _engine.raw_connection()
+    return pooled
+
+
+def get_file_version(path: Path) -> tuple | None:
+    """Changes whenever a commit is made to the SQLite database at path.
+
+    Uses the file change counter from the SQLite header (bytes 24-27), which is
+    bumped on every commit in rollback-journal mode, plus the WAL file state for
+    databases in WAL mode. Unlike PRAGMA data_version it does not depend on the
+    connection the query runs on.
+    """
+    try:
+        with open(path, "rb") as f:
+            f.seek(24)
+            change_counter = int.from_bytes(f.read(4), "big")
+    except FileNotFoundError:
+        return None
+    try:
+        wal = os.stat(f"{path}-wal")
+        wal_state = (wal.st_mtime_ns, wal.st_size)
+    except FileNotFoundError:
+        wal_state = None
+    return change_counter, wal_state
+
+
+def get_source_version() -> tuple | None:
+    """Changes whenever the tracker commits to the PersonalAnalytics database, or the mirror is synced."""
+    return get_file_version(get_query_db_path())
+
+
+def get_data_version() -> tuple:
+    """Changes whenever anything a query can read changes, including the attached analytics database."""
+    return get_source_version(), get_file_version(get_analytics_db_path())
+
+
+class QueryCancelled(Exception):
+    """Raised when a query was interrupted because it exceeded its budget or was cancelled."""
+
+
+def execute_with_budget(query: str, budget: QueryBudget,
+                        cancel_event: threading.Event = None) -> tuple[ResultTable, bool]:
+    """Execute a query on this thread's pooled connection and enforce the budget.
+
+    The SQLite progress handler aborts the running statement once the wall time or
+    VM step budget is used up or cancel_event is set, so the connection and the
+    worker thread are released right away. Returns the rows and whether they were
+    truncated to budget.max_rows.
+    """
+    deadline = time.monotonic() + budget.timeout_seconds
+    steps = 0
+    reason = None
+
+    def check_budget():
+        nonlocal steps, reason
+        steps += PROGRESS_INTERVAL
+        if cancel_event is not None and cancel_event.is_set():
+            reason = "Query execution was cancelled."
+        elif time.monotonic() > deadline:
+            reason = f"Query execution exceeded {budget.timeout_seconds:g} seconds and was aborted."
+        elif budget.max_vm_steps is not None and steps > budget.max_vm_steps:
+            reason = f"Query execution exceeded {budget.max_vm_steps} VM steps and was aborted."
+        return 1 if reason else 0
+
+    pooled = checkout_connection()
+    conn: sqlite3.Connection = pooled.driver_connection
+    conn.set_progress_handler(check_budget, PROGRESS_INTERVAL)
+    cursor = conn.cursor()
+    try:
+        cursor.execute(query)
+        if cursor.description is None:
+            return ResultTable.empty(), False
+        columns = [column[0] for column in cursor.description]
+        if budget.max_rows is None:
+            rows = cursor.fetchall()
+            truncated = False
+        else:
+            rows = cursor.fetchmany(budget.max_rows + 1)
+            truncated = len(rows) > budget.max_rows
+            rows = rows[:budget.max_rows]
+        return ResultTable.from_rows(columns, rows), truncated
+    except sqlite3.OperationalError as e:
+        if reason:
+            raise QueryCancelled(reason) from e
+        raise
+    finally:
+        cursor.close()
+        conn.set_progress_handler(None, 0)
+        pooled.close()
+
+
+def run_query(query: str, budget: QueryBudget = None,
+              cancel_event: threading.Event = None) -> tuple[ResultTable, bool]:
+    """Execute a read-only query, answering repeated queries on unchanged data from the cache.
+
+    Returns the rows and whether they were truncated to budget.max_rows.
+    """
+    budget = budget or QueryBudget()
+    sync_mirror()
+    version = get_data_version()
+    rows = _result_cache.get(query, version)
+    truncated = False
+    if rows is None:
+        rows, truncated = execute_with_budget(query, budget, cancel_event)
+        if truncated:
+            logging.info(f"[run_query] Result truncated to {budget.max_rows} rows")
+        # Truncated results or results that changed while the query ran are not cached
+        elif get_data_version() == version:
+            _result_cache.put(query, version, rows)
+    if budget.max_rows is not None and len(rows) > budget.max_rows:
+        rows = rows.head(budget.max_rows)
+        truncated = True
+    return rows, truncated
+
+
+async def submit_query(query: str, budget: QueryBudget = None) -> tuple[ResultTable, bool]:
+    """Run a query on the shared executor without blocking the event loop; see run_query."""
+    budget = budget or QueryBudget()
+    cancel_event = threading.Event()
+    future = query_executor.submit(run_query, query, budget, cancel_event)
+    try:
+        # The progress handler enforces the deadline; the grace period only covers queueing
+        return await asyncio.wait_for(asyncio.wrap_future(future), timeout=budget.timeout_seconds + 5)
+    except BaseException:
+        # Also reached when the awaiting task is cancelled, e.g. because the client went away
+        cancel_event.set()
+        raise
+
+
+_table_stats: tuple[tuple, dict[str, TableStats]] | None = None
+
+
+def get_table_stats(conn: sqlite3.Connection) -> dict[str, TableStats]:
+    """Row counts and time span of every table a query can read, cached per data version.
+
+    Rows are appended in time order, so the highest rowid approximates the row count and
+    the rows with the lowest and highest rowid hold the time span, all from index lookups.
+    """
+    global _table_stats
+    version = get_data_version()
+    if _table_stats is not None and _table_stats[0] == version:
+        return _table_stats[1]
+    stats = {}
+    schemas = [row[1] for row in conn.execute("PRAGMA database_list") if row[1] != "temp"]
+    for schema in schemas:
+        tables = conn.execute(
+            f"SELECT name FROM {schema}.sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'"
+        ).fetchall()
+        for (table,) in tables:
+            columns = {row[1] for row in conn.execute(f'PRAGMA {schema}.table_info("{table}")')}
+            try:
+                rows = conn.execute(f'SELECT COALESCE(MAX(rowid), 0) FROM {schema}."{table}"').fetchone()[0]
+                first_ts = last_ts = None
+                if "tsStart" in columns and rows:
+                    first_ts, last_ts = conn.execute(f"""
+                        SELECT (SELECT tsStart FROM {schema}."{table}" ORDER BY rowid LIMIT 1),
+                               (SELECT tsStart FROM {schema}."{table}" ORDER BY rowid DESC LIMIT 1)
+                    """).fetchone()
+            except sqlite3.OperationalError:
+                # WITHOUT ROWID tables have no rowid to go by
+                rows = conn.execute(f'SELECT COUNT(*) FROM {schema}."{table}"').fetchone()[0]
+                first_ts = last_ts = None
+            stats[table.lower()] = TableStats(rows, first_ts, last_ts)
+    _table_stats = (version, stats)
+    return stats
+
+
+def guard_query(query: str, time_filter: TimeFilter = None, limit: int = None) -> QueryVerdict:
+    """Check the plan of a query before running it, see helper.query_guard.analyze_query."""
+    sync_mirror()
+    pooled = checkout_connection()
+    conn: sqlite3.Connection = pooled.driver_connection
+    try:
+        return analyze_query(
+            query,
+            lambda q: conn.execute(f"EXPLAIN QUERY PLAN {q}").fetchall(),
+            get_table_stats(conn),
+            time_filter,
+            limit
+        )
+    finally:
+        pooled.close()
+
+
+async def submit_guard(query: str, time_filter: TimeFilter = None, limit: int = None) -> QueryVerdict:
+    """Run guard_query on the query executor, so it uses the same pooled connections."""
+    return await asyncio.wrap_future(query_executor.submit(guard_query, query, time_filter, limit))
+
+
+def get_result_cache_stats() -> dict:
+    return _result_cache.stats()
+
+
 def migrate_checkpoint_db(old_path: Path, new_path: Path):
     if not old_path.exists():
         return
@@ -56,17 +316,8 @@ def migrate_checkpoint_db(old_path: Path, new_path: Path):
 
 
 def get_chat_db_path():
-    if sys.platform == "darwin":
-        new_checkpoint_dir = Path.home() / "Library" / "Application Support" / "personal-query"
-    else:
-        new_checkpoint_dir = Path(os.getenv("APPDATA", Path.home())) / "personal-query"
-    return new_checkpoint_dir / "chat_checkpoints.db"
-
-
-def get_app_data_dir() -> Path:
-    if sys.platform == "darwin":
-        return Path.home() / "Library" / "Application Support" / "personal-query"
-    else:
-        return Path(os.getenv("APPDATA", Path.home())) / "personal-query"
+    return get_app_data_dir() / "chat_checkpoints.db"
 
 
+def get_analytics_db_path() -> Path:
+    return get_app_data_dir() / "analytics.db"
@@ -1,6 +1,84 @@
+import os
 import re
+import time
+
+from langchain_core.messages import AIMessage, AIMessageChunk
+
+STREAM_COALESCE_SECONDS = float(os.getenv("PQ_STREAM_COALESCE_MS", "50")) / 1000
 
 
 def convert_bracket_to_dollar_latex(text: str) -> str:
     """Replaces LaTeX math blocks with $$ $$ for frontend display compatibility."""
-    return re.sub(r'\\\[(.*?)\\\]', r'$$\1$$', text, flags=re.DOTALL)
\ No newline at end of file
+    return re.sub(r'\\\[(.*?)\\\]', r'$$\1$$', text, flags=re.DOTALL)
+
+
+def estimate_tokens(text: str) -> int:
+    """Approximate token count (about four characters per token for English and markdown tables)."""
+    return len(text) // 4 + 1
+
+
+class StreamingLatexConverter:
+    """Applies convert_bracket_to_dollar_latex to a stream of text pieces.
+
+    Only the unconverted tail is scanned on every feed. Text from an opening \\[ on is
+    held back until the matching \\] arrives, so the concatenated output equals the
+    conversion of the complete text.
+    """
+
+    def __init__(self):
+        self._pending = ""
+
+    def feed(self, text: str) -> str:
+        self._pending += text
+        out = []
+        while True:
+            start = self._pending.find("\\[")
+            if start == -1:
+                # A trailing backslash may be the start of the next \[
+                keep = 1 if self._pending.endswith("\\") else 0
+                out.append(self._pending[:len(self._pending) - keep])
+                self._pending = self._pending[len(self._pending) - keep:]
+                break
+            end = self._pending.find("\\]", start + 2)
+            if end == -1:
+                out.append(self._pending[:start])
+                self._pending = self._pending[start:]
+                break
+            out.append(self._pending[:start] + "$$" + self._pending[start + 2:end] + "$$")
+            self._pending = self._pending[end + 2:]
+        return "".join(out)
+
+    def flush(self) -> str:
+        text, self._pending = self._pending, ""
+        return text
+
+
+async def stream_answer(stream, ws, convert_latex: bool = True) -> AIMessage:
+    """Consume an LLM stream, send the new text as coalesced deltas and return the whole message.
+
+    Deltas are sent at most every STREAM_COALESCE_SECONDS; the client appends them to the
+    message with the same id. The complete message is sent once by the caller afterwards.
+    """
+    final_msg = AIMessage(content="")
+    converter = StreamingLatexConverter() if convert_latex else None
+    buffered = []
+    last_sent = time.monotonic()
+
+    async def send(delta: str):
+        if ws and delta:
+            await ws.send_json({"type": "chunk", "delta": delta, "id": final_msg.id})
+
+    async for chunk in stream:
+        if isinstance(chunk, AIMessageChunk):
+            final_msg = chunk if final_msg.content == "" else final_msg + chunk
+            buffered.append(converter.feed(chunk.content) if converter else chunk.content)
+            now = time.monotonic()
+            if now - last_sent >= STREAM_COALESCE_SECONDS:
+                await send("".join(buffered))
+                buffered.clear()
+                last_sent = now
+
+    if converter:
+        buffered.append(converter.flush())
+    await send("".join(buffered))
+    return final_msg
@@ -1,75 +1,127 @@
-import os
-import aiosqlite
-from pathlib import Path
 from typing import Dict, List
 from langchain_core.messages import HumanMessage, SystemMessage
 from langchain_core.prompt_values import ChatPromptValue
 
-from database import get_chat_db_path
+from helper.query_guard import route_checked_query
+from chat_db import ChatDB
 from schemas import WantsPlot, State
 
-APPDATA_PATH = Path(os.getenv("APPDATA", Path.home()))
-CHECKPOINT_DB_PATH = get_chat_db_path()
+
+async def checkpoints_table_exists() -> bool:
+    row = await ChatDB.fetchone("SELECT name FROM sqlite_master WHERE type='table' AND name='checkpoints'")
+    return row is not None
+
+
+async def seed_thread_id_sequence():
+    """Start the thread ID sequence after the highest numeric ID in use, once per database."""
+    await ChatDB.execute("""
+        INSERT OR IGNORE INTO app_state (key, value)
+        SELECT 'last_thread_id', COALESCE(MAX(CAST(thread_id AS INTEGER)), 0)
+        FROM chat_metadata
+        WHERE thread_id != '' AND thread_id NOT GLOB '*[^0-9]*'
+    """)
 
 
 async def get_next_thread_id() -> str:
-    async with aiosqlite.connect(str(CHECKPOINT_DB_PATH)) as conn:
-        async with conn.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='checkpoints'") as cursor:
-            if await cursor.fetchone() is None:
-                return "1"
+    """Allocate a new thread ID in a single atomic UPDATE, so concurrent requests never collide."""
+    async with ChatDB.transaction() as conn:
+        async with conn.execute("""
+            UPDATE app_state
+            SET value = CAST(value AS INTEGER) + 1
+            WHERE key = 'last_thread_id'
+            RETURNING value
+        """) as cursor:
+            row = await cursor.fetchone()
+    return str(row[0])
+
+
+async def backfill_chat_metadata():
+    """Give every thread with checkpoints a chat_metadata row, once per database.
+
+    Chat listing only reads chat_metadata, so threads created before it was
+    maintained would otherwise disappear from the sidebar.
+    """
+    if await ChatDB.fetchone("SELECT 1 FROM app_state WHERE key = 'chat_metadata_backfilled'"):
+        return
+    async with ChatDB.transaction() as conn:
+        if await checkpoints_table_exists():
+            await conn.execute("""
+                INSERT OR IGNORE INTO chat_metadata (thread_id)
+                SELECT DISTINCT thread_id FROM checkpoints
+            """)
+        await conn.execute("INSERT INTO app_state (key, value) VALUES ('chat_metadata_backfilled', '1')")
 
-        async with conn.execute("SELECT DISTINCT thread_id FROM checkpoints") as cursor:
-            thread_ids = [row[0] async for row in cursor]
 
-    numeric_ids = [int(tid) for tid in thread_ids if tid.isdigit()]
-    next_id = max(numeric_ids, default=0) + 1
-    return str(next_id)
+def encode_chat_cursor(last_activity: str | None, thread_id: str) -> str:
+    return f"{last_activity or ''}|{thread_id}"
 
 
-async def list_chats() -> List[Dict[str, str]]:
-    async with aiosqlite.connect(str(CHECKPOINT_DB_PATH)) as conn:
-        async with conn.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='checkpoints'") as cursor:
-            if await cursor.fetchone() is None:
-                return []
+def decode_chat_cursor(cursor: str) -> tuple[str | None, str]:
+    last_activity, _, thread_id = cursor.rpartition("|")
+    return last_activity or None, thread_id
 
-        async with conn.execute("SELECT DISTINCT thread_id FROM checkpoints") as cursor:
-            thread_ids = [row[0] async for row in cursor]
 
-        result = []
-        for tid in thread_ids:
-            async with conn.execute("SELECT title, last_activity FROM chat_metadata WHERE thread_id = ?", (tid,)) as cursor:
-                row = await cursor.fetchone()
+async def list_chats(after: str | None = None, limit: int | None = None) -> Dict:
+    """List chats ordered by last activity, newest first, with keyset pagination.
 
-            title_raw = row[0] if row else None
-            title = title_raw.strip() if title_raw and title_raw.strip() else f"New Chat [{tid}]"
-            last_activity = row[1] if row and row[1] else None
+    `after` is the `next_cursor` of the previous page. Chats without any activity
+    come last. A single query over the last_activity index serves each page.
+    """
+    if not await checkpoints_table_exists():
+        return {"chats": [], "next_cursor": None}
+
+    conditions = ["EXISTS (SELECT 1 FROM checkpoints c WHERE c.thread_id = m.thread_id)"]
+    params = []
+    if after:
+        cursor_activity, cursor_tid = decode_chat_cursor(after)
+        if cursor_activity is None:
+            conditions.append("(m.last_activity IS NULL AND m.thread_id < ?)")
+            params.append(cursor_tid)
+        else:
+            conditions.append("""(
+                m.last_activity < ?
+                OR (m.last_activity = ? AND m.thread_id < ?)
+                OR m.last_activity IS NULL
+            )""")
+            params.extend([cursor_activity, cursor_activity, cursor_tid])
+
+    sql = f"""
+        SELECT m.thread_id, m.title, m.last_activity
+        FROM chat_metadata m
+        WHERE {" AND ".join(conditions)}
+        ORDER BY m.last_activity DESC, m.thread_id DESC
+    """
+    if limit is not None:
+        sql += " LIMIT ?"
+        params.append(limit)
 
-            result.append({
-                "id": tid,
-                "title": title,
-                "last_activity": last_activity
-            })
+    rows = await ChatDB.fetchall(sql, params)
 
-        return result
+    result = []
+    for tid, title_raw, last_activity in rows:
+        title = title_raw.strip() if title_raw and title_raw.strip() else f"New Chat [{tid}]"
+        result.append({
+            "id": tid,
+            "title": title,
+            "last_activity": last_activity or None
+        })
 
+    next_cursor = None
+    if limit is not None and len(rows) == limit:
+        next_cursor = encode_chat_cursor(rows[-1][2], rows[-1][0])
+    return {"chats": result, "next_cursor": next_cursor}
 
-async def is_new_chat(thread_id: str) -> bool:
-    async with aiosqlite.connect(str(CHECKPOINT_DB_PATH)) as conn:
-        async with conn.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='checkpoints'") as cursor:
-            if await cursor.fetchone() is None:
-                return True
 
-        async with conn.execute("SELECT 1 FROM checkpoints WHERE thread_id = ? LIMIT 1", (thread_id,)) as cursor:
-            result = await cursor.fetchone()
+async def is_new_chat(thread_id: str) -> bool:
+    if not await checkpoints_table_exists():
+        return True
 
-        return result is None
+    result = await ChatDB.fetchone("SELECT 1 FROM checkpoints WHERE thread_id = ? LIMIT 1", (thread_id,))
+    return result is None
 
 
 async def title_exists(thread_id: str) -> bool:
-    async with aiosqlite.connect(str(CHECKPOINT_DB_PATH)) as conn:
-        async with conn.execute("SELECT title FROM chat_metadata WHERE thread_id = ? LIMIT 1", (thread_id,)) as cursor:
-            row = await cursor.fetchone()
-
+    row = await ChatDB.fetchone("SELECT title FROM chat_metadata WHERE thread_id = ? LIMIT 1", (thread_id,))
     return bool(row and row[0] and row[0].strip())
 
 
@@ -78,18 +130,18 @@ def give_correct_step(current_node: str, state: State) -> str:
     branch = state.get('branch')
     title_exist = state.get('title_exist')
     wants_plot = state.get('wants_plot')
+    parallel_plot = state.get('parallel_plot')
     if branch == "general_qa":
         return "generate_answer"
 
     data_query_map = {
         "classify_question": "generate_title" if not title_exist else "give_context",
         "generate_title": "give_context",
-        "give_context": "get_tables",
-        "get_tables": "extract_activities",
-        "extract_activities": "get_scope",
-        "get_scope": "write_query",
-        "write_query": "execute_query",
-        "execute_query": "generate_answer" if wants_plot == WantsPlot.NO else "check_if_plot_needed" if wants_plot == WantsPlot.AUTO else "create_plot",
+        "give_context": "plan_query",
+        "plan_query": "write_query",
+        "write_query": "check_query",
+        "check_query": route_checked_query(state),
+        "execute_query": "generate_answer" if parallel_plot or wants_plot == WantsPlot.NO else "check_if_plot_needed" if wants_plot == WantsPlot.AUTO else "create_plot",
         "check_if_plot_needed": "generate_answer" if wants_plot == WantsPlot.NO else "create_plot",
         "create_plot": "run_plot_script",
         "run_plot_script": "generate_answer"
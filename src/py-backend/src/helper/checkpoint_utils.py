@@ -0,0 +1,153 @@
+import asyncio
+import logging
+from typing import Dict, List
+
+from blob_store import BLOB_REF_PATTERN, BlobStore
+from chat_db import ChatDB
+from helper.chat_utils import checkpoints_table_exists
+
+
+async def database_size() -> tuple[int, int]:
+    """Bytes used by live pages and total file size in bytes."""
+    page_count = (await ChatDB.fetchone("PRAGMA page_count"))[0]
+    freelist_count = (await ChatDB.fetchone("PRAGMA freelist_count"))[0]
+    page_size = (await ChatDB.fetchone("PRAGMA page_size"))[0]
+    return (page_count - freelist_count) * page_size, page_count * page_size
+
+
+async def checkpoint_sizes() -> List[Dict]:
+    """Number of checkpoints and bytes of checkpoint and write blobs per thread, largest first."""
+    if not await checkpoints_table_exists():
+        return []
+
+    rows = await ChatDB.fetchall("""
+        SELECT c.thread_id, c.checkpoints, c.bytes + COALESCE(w.bytes, 0)
+        FROM (
+            SELECT thread_id,
+                   COUNT(*) AS checkpoints,
+                   SUM(LENGTH(checkpoint) + COALESCE(LENGTH(metadata), 0)) AS bytes
+            FROM checkpoints
+            GROUP BY thread_id
+        ) c
+        LEFT JOIN (
+            SELECT thread_id, SUM(COALESCE(LENGTH(value), 0)) AS bytes
+            FROM writes
+            GROUP BY thread_id
+        ) w ON w.thread_id = c.thread_id
+        ORDER BY 3 DESC
+    """)
+    return [{"thread_id": tid, "checkpoints": count, "bytes": size} for tid, count, size in rows]
+
+
+async def referenced_blob_digests() -> set[str]:
+    """Digests of all blob references held by the checkpoints and pending writes."""
+    digests = set()
+    async with ChatDB.connection().execute("""
+        SELECT checkpoint, metadata FROM checkpoints
+        UNION ALL
+        SELECT value, NULL FROM writes
+    """) as cursor:
+        async for row in cursor:
+            for value in row:
+                if isinstance(value, str):
+                    value = value.encode("utf-8")
+                if value:
+                    digests.update(match.decode("ascii") for match in BLOB_REF_PATTERN.findall(value))
+    return digests
+
+
+async def collect_blob_garbage() -> Dict:
+    """Delete result and plot blobs no checkpoint refers to anymore."""
+    if not await checkpoints_table_exists():
+        # Without the table there is nothing to tell referenced blobs apart
+        return {"deleted_blobs": 0, "bytes_freed": 0}
+    report = await asyncio.to_thread(BlobStore.collect_garbage, await referenced_blob_digests())
+    if report["deleted_blobs"]:
+        logging.info(f"[collect_blob_garbage] Deleted {report['deleted_blobs']} blobs, "
+                     f"freed {report['bytes_freed']} bytes")
+    return report
+
+
+async def enable_incremental_vacuum():
+    """Switch the checkpoint database to auto_vacuum=INCREMENTAL.
+
+    Changing the mode of an existing database only takes effect after a full VACUUM,
+    which is therefore run once.
+    """
+    mode = (await ChatDB.fetchone("PRAGMA auto_vacuum"))[0]
+    if mode == 2:
+        return
+    conn = ChatDB.connection()
+    await conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    await conn.execute("VACUUM")
+
+
+async def compact_checkpoints() -> Dict:
+    """Drop intermediate checkpoints and return the space to the file system.
+
+    Keeps the latest checkpoint of every thread (which holds the complete chat state)
+    and any checkpoint with a pending interrupt, together with their pending writes.
+    Blobs of deleted chats and dropped checkpoints are removed here as well, since
+    finding them means scanning every remaining checkpoint.
+    """
+    if not await checkpoints_table_exists():
+        return {"deleted_checkpoints": 0, "deleted_writes": 0, "bytes_reclaimed": 0,
+                "deleted_blobs": 0, "bytes_freed": 0, "threads": []}
+
+    _, file_size_before = await database_size()
+
+    async with ChatDB.transaction() as conn:
+        cursor = await conn.execute("""
+            DELETE FROM checkpoints
+            WHERE checkpoint_id != (
+                SELECT MAX(latest.checkpoint_id)
+                FROM checkpoints latest
+                WHERE latest.thread_id = checkpoints.thread_id
+                  AND latest.checkpoint_ns = checkpoints.checkpoint_ns
+            )
+            AND NOT EXISTS (
+                SELECT 1
+                FROM writes w
+                WHERE w.thread_id = checkpoints.thread_id
+                  AND w.checkpoint_ns = checkpoints.checkpoint_ns
+                  AND w.checkpoint_id = checkpoints.checkpoint_id
+                  AND w.channel = '__interrupt__'
+            )
+        """)
+        deleted_checkpoints = cursor.rowcount
+        cursor = await conn.execute("""
+            DELETE FROM writes
+            WHERE NOT EXISTS (
+                SELECT 1
+                FROM checkpoints c
+                WHERE c.thread_id = writes.thread_id
+                  AND c.checkpoint_ns = writes.checkpoint_ns
+                  AND c.checkpoint_id = writes.checkpoint_id
+            )
+        """)
+        deleted_writes = cursor.rowcount
+
+    try:
+        async with ChatDB.transaction() as conn:
+            await enable_incremental_vacuum()
+            # executescript steps the pragma to completion; execute would only free a single page
+            await conn.executescript("PRAGMA incremental_vacuum;")
+    except Exception as e:
+        logging.warning(f"[compact_checkpoints] Vacuum skipped: {e}")
+
+    _, file_size_after = await database_size()
+    try:
+        blobs = await collect_blob_garbage()
+    except Exception as e:
+        logging.warning(f"[compact_checkpoints] Blob cleanup skipped: {e}")
+        blobs = {"deleted_blobs": 0, "bytes_freed": 0}
+    report = {
+        "deleted_checkpoints": deleted_checkpoints,
+        "deleted_writes": deleted_writes,
+        "bytes_reclaimed": file_size_before - file_size_after,
+        **blobs,
+        "threads": await checkpoint_sizes()
+    }
+    logging.info(f"[compact_checkpoints] Deleted {deleted_checkpoints} checkpoints and {deleted_writes} writes, "
+                 f"reclaimed {report['bytes_reclaimed']} bytes")
+    return report
@@ -0,0 +1,69 @@
+import re
+import threading
+from collections import OrderedDict
+from typing import Hashable
+
+from result_table import ResultTable
+
+_LITERAL_PATTERN = re.compile(r"('(?:[^']|'')*'|\"(?:[^\"]|\"\")*\")")
+
+
+def normalize_sql(query: str) -> str:
+    """Collapse whitespace outside of string literals and drop the trailing semicolon."""
+    parts = _LITERAL_PATTERN.split(query.strip())
+    normalized = "".join(
+        part if i % 2 else re.sub(r"\s+", " ", part)
+        for i, part in enumerate(parts)
+    )
+    return normalized.strip().rstrip(";").strip()
+
+
+class QueryResultCache:
+    """LRU cache of SQL results, bounded in bytes and invalidated when the data version changes."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[str, tuple[ResultTable, int]] = OrderedDict()
+        self._size = 0
+        self._version: Hashable = None
+        self._lock = threading.Lock()
+
+    def _check_version(self, version: Hashable):
+        if version != self._version:
+            self._entries.clear()
+            self._size = 0
+            self._version = version
+
+    def get(self, query: str, version: Hashable) -> ResultTable | None:
+        key = normalize_sql(query)
+        with self._lock:
+            self._check_version(version)
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, query: str, version: Hashable, rows: ResultTable):
+        size = rows.nbytes
+        if size > self.max_bytes:
+            return
+        key = normalize_sql(query)
+        with self._lock:
+            self._check_version(version)
+            previous = self._entries.pop(key, None)
+            if previous:
+                self._size -= previous[1]
+            self._entries[key] = (rows, size)
+            self._size += size
+            while self._size > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._size -= evicted_size
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries), "bytes": self._size}
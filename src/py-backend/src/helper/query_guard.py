@@ -0,0 +1,381 @@
+import os
+import re
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Callable, Optional
+
+from helper.sql_compiler import compile_time_filter
+from schemas import State, TimeFilter
+
+GUARD_ENABLED = os.getenv("PQ_QUERY_GUARD", "1") == "1"
+# Estimated row visits a query may cost; SQLite visits a few ten million rows per second
+MAX_QUERY_COST = float(os.getenv("PQ_QUERY_MAX_COST", "5e7"))
+# Queries written in total before one the guard rejects is reported instead of executed
+MAX_QUERY_ATTEMPTS = 3
+
+# Tables large enough for a missing time predicate to matter
+TIME_FILTERED_TABLES = ("window_activity", "user_input")
+TIME_COLUMNS = {"tsstart", "tsend", "tsstartepoch", "tsendepoch", "hour"}
+
+_TOKEN = re.compile(
+    r"""\s+|--[^\n]*|/\*.*?\*/|'(?:[^']|'')*'|"(?:[^"]|"")*"|`[^`]*`|\[[^\]]*\]|\d+(?:\.\d+)?|\w+|<=|>=|<>|!=|==|\|\||.""",
+    re.S
+)
+_KEYWORDS = {
+    "select", "from", "where", "join", "inner", "left", "right", "full", "outer", "cross", "natural",
+    "on", "using", "group", "order", "by", "having", "limit", "offset", "window", "union", "all",
+    "except", "intersect", "as", "with", "values", "and", "or", "not", "indexed",
+}
+_FROM_END = {"where", "group", "order", "limit", "having", "window", "union", "except", "intersect", "on", "using"}
+_AGGREGATES = {"count", "sum", "avg", "min", "max", "total", "group_concat"}
+_COMPARISONS = {"=", "==", "<", ">", "<=", ">=", "<>", "!=", "between", "in", "like", "glob"}
+_DATE_FUNCTIONS = {"date", "datetime", "strftime", "julianday", "unixepoch"}
+
+_PLAN_LOOP = re.compile(r"^(SCAN|SEARCH) (\S+(?: \S+)*?)(?: AS \S+)?(?: USING (.*))?$")
+
+
+@dataclass(frozen=True)
+class Token:
+    text: str
+    start: int
+    end: int
+
+    @property
+    def word(self) -> str:
+        """Lower-cased identifier with quotes removed, or "" for anything else."""
+        text = self.text
+        if text[:1] in "\"`[" and len(text) > 1:
+            return text[1:-1].lower()
+        return text.lower() if text[:1].isalpha() or text[:1] == "_" else ""
+
+    @property
+    def is_literal(self) -> bool:
+        return self.text[:1] == "'" or self.text[:1].isdigit()
+
+
+@dataclass(frozen=True)
+class TableRef:
+    name: str
+    alias: str
+    start: int
+    end: int
+    has_alias: bool
+
+
+@dataclass
+class SqlShape:
+    """What the guard needs to know about a statement, read from its tokens."""
+    tables: list[TableRef] = field(default_factory=list)
+    ctes: set[str] = field(default_factory=set)
+    time_filtered: set[str] = field(default_factory=set)
+    aggregates: bool = False
+    outer_limit: bool = False
+    range_join: bool = False
+    statements: int = 1
+
+    def table_of(self, alias: str) -> str:
+        for ref in self.tables:
+            if ref.alias == alias:
+                return ref.name
+        return alias
+
+
+def tokenize(sql: str) -> list[Token]:
+    return [Token(m.group(), m.start(), m.end()) for m in _TOKEN.finditer(sql)
+            if not m.group().isspace() and not m.group().startswith(("--", "/*"))]
+
+
+def _is_time_operand(tokens: list[Token], i: int) -> bool:
+    """Whether tokens[i] starts a literal, or a date function applied to one."""
+    if i >= len(tokens):
+        return False
+    if tokens[i].text == "(":
+        i += 1
+    if i < len(tokens) and tokens[i].is_literal:
+        return True
+    return i + 2 < len(tokens) and tokens[i].word in _DATE_FUNCTIONS and tokens[i + 1].text == "(" and tokens[i + 2].is_literal
+
+
+def parse_sql(sql: str) -> SqlShape:
+    """Table references, CTE names and time predicates of a SELECT, from a token scan.
+
+    Not a full parser: it only follows parentheses and the clause keywords that decide
+    where table names and comparisons can appear, which is enough for generated SELECTs.
+    """
+    tokens = tokenize(sql)
+    shape = SqlShape()
+    shape.statements = sum(1 for i, t in enumerate(tokens) if t.text == ";" and i < len(tokens) - 1) + 1
+    depth = 0
+    in_from = {0: False}
+    expect_table = False
+    qualified_time_columns = []
+    i = 0
+    while i < len(tokens):
+        token, word = tokens[i], tokens[i].word
+        if token.text == "(":
+            depth += 1
+            in_from[depth] = False
+            expect_table = False
+        elif token.text == ")":
+            depth = max(depth - 1, 0)
+        elif word == "from" or word == "join":
+            in_from[depth] = True
+            expect_table = True
+        elif word in _FROM_END:
+            in_from[depth] = False
+            expect_table = False
+            if word == "limit" and depth == 0:
+                shape.outer_limit = True
+        elif token.text == "," and in_from.get(depth):
+            expect_table = True
+        elif expect_table and word and word not in _KEYWORDS:
+            start, name, j = token.start, word, i + 1
+            if j + 1 < len(tokens) and tokens[j].text == "." and tokens[j + 1].word:
+                name, j = tokens[j + 1].word, j + 2
+            end = tokens[j - 1].end
+            alias, has_alias = name, False
+            if j < len(tokens) and tokens[j].word == "as":
+                j += 1
+            if j < len(tokens) and tokens[j].word and tokens[j].word not in _KEYWORDS:
+                alias, has_alias, j = tokens[j].word, True, j + 1
+            shape.tables.append(TableRef(name, alias, start, end, has_alias))
+            expect_table = False
+            i = j
+            continue
+        else:
+            expect_table = False
+
+        if word and i + 2 < len(tokens) and tokens[i + 1].word == "as" and tokens[i + 2].text == "(":
+            shape.ctes.add(word)
+        if word in _AGGREGATES and i + 1 < len(tokens) and tokens[i + 1].text == "(":
+            shape.aggregates = True
+        if word == "group" and i + 1 < len(tokens) and tokens[i + 1].word == "by":
+            shape.aggregates = True
+        if word in TIME_COLUMNS:
+            qualifier = tokens[i - 2].word if i >= 2 and tokens[i - 1].text == "." else ""
+            qualified_time_columns.append((i, qualifier))
+        i += 1
+
+    for i, qualifier in qualified_time_columns:
+        # Skip the closing parentheses of a function the column is wrapped in, e.g. date(tsStart)
+        j = i + 1
+        while j < len(tokens) and tokens[j].text == ")":
+            j += 1
+        operator = tokens[j].word or tokens[j].text if j < len(tokens) else ""
+        after = operator in _COMPARISONS
+        if operator == "between" and j + 3 < len(tokens) and tokens[j + 2].text == ".":
+            shape.range_join = True
+        # The literal may also come first, as in '2025-05-01' <= tsStart
+        prev = i - 3 if qualifier else i - 1
+        before = prev >= 1 and tokens[prev].text in _COMPARISONS and tokens[prev - 1].is_literal
+        if (after and _is_time_operand(tokens, j + 1)) or before:
+            if qualifier:
+                shape.time_filtered.add(shape.table_of(qualifier))
+            else:
+                shape.time_filtered.update(ref.name for ref in shape.tables)
+    return shape
+
+
+@dataclass(frozen=True)
+class TableStats:
+    rows: int
+    first_ts: Optional[str] = None
+    last_ts: Optional[str] = None
+
+
+def _parse_ts(value: str) -> Optional[datetime]:
+    try:
+        return datetime.fromisoformat(value[:19])
+    except (TypeError, ValueError):
+        return None
+
+
+def time_selectivity(stats: TableStats, time_filter: Optional[TimeFilter]) -> float:
+    """Share of a table's rows inside the time filter, assuming rows are spread evenly over its span."""
+    first, last = _parse_ts(stats.first_ts), _parse_ts(stats.last_ts)
+    if time_filter is None or first is None or last is None or last <= first:
+        return 1.0
+    if time_filter.type == "single":
+        days = [(time_filter.date, time_filter.date)]
+    elif time_filter.type == "range":
+        days = [(time_filter.from_date, time_filter.to_date)]
+    else:
+        days = [(d, d) for d in set(time_filter.dates)]
+    overlap = 0.0
+    for from_date, to_date in days:
+        start = datetime.combine(from_date, datetime.min.time())
+        end = datetime.combine(to_date, datetime.min.time()) + timedelta(days=1)
+        overlap += max((min(end, last) - max(start, first)).total_seconds(), 0)
+    return min(max(overlap / (last - first).total_seconds(), 1 / max(stats.rows, 1)), 1.0)
+
+
+@dataclass
+class PlanCost:
+    cost: float = 0.0
+    rows: float = 1.0
+    loops: list[tuple[str, float]] = field(default_factory=list)
+    sorts: bool = False
+
+
+def estimate_plan_cost(plan: list[tuple], shape: SqlShape, stats: dict[str, TableStats],
+                       selectivity: dict[str, float]) -> PlanCost:
+    """Estimate row visits from EXPLAIN QUERY PLAN rows (id, parent, notused, detail).
+
+    Loops listed under the same parent are nested, so each one is visited once per row
+    coming out of the loops before it. A SCAN visits every row of its table; a SEARCH
+    visits the rows its index constraint selects, guessed the way SQLite's planner does
+    without statistics. Known time predicates shrink the rows a loop passes on.
+    """
+    children: dict[int, list[tuple]] = {}
+    for row in plan:
+        children.setdefault(row[1], []).append(row)
+    subquery_rows: dict[str, float] = {}
+
+    def table_rows(name: str) -> float:
+        table = shape.table_of(name.lower())
+        if table in stats:
+            return stats[table].rows
+        return subquery_rows.get(table, subquery_rows.get(name.lower(), 1000.0))
+
+    def level(parent: int) -> PlanCost:
+        result = PlanCost()
+        for node_id, _, _, detail in children.get(parent, []):
+            match = _PLAN_LOOP.match(detail)
+            if detail.startswith(("MATERIALIZE ", "CO-ROUTINE ")):
+                sub = level(node_id)
+                result.cost += sub.cost
+                result.loops += sub.loops
+                subquery_rows[detail.split(" ", 1)[1].lower()] = sub.rows
+            elif detail.startswith("COMPOUND QUERY"):
+                sub = level(node_id)
+                result.cost += sub.cost
+                result.loops += sub.loops
+                result.rows = sub.rows
+            elif detail.startswith(("LEFT-MOST SUBQUERY", "UNION", "EXCEPT", "INTERSECT")):
+                sub = level(node_id)
+                result.cost += sub.cost
+                result.loops += sub.loops
+                # Compound parts run one after another, so their rows add up
+                result.rows = sub.rows if detail.startswith("LEFT-MOST") else result.rows + sub.rows
+            elif "SUBQUERY" in detail:
+                sub = level(node_id)
+                repeat = result.rows if detail.startswith("CORRELATED") else 1
+                result.cost += repeat * sub.cost
+                result.loops += sub.loops
+            elif detail.startswith("USE TEMP B-TREE"):
+                result.sorts = True
+            elif match and match.group(2) != "CONSTANT ROW":
+                name, using = match.group(2), match.group(3) or ""
+                total = table_rows(name)
+                table = shape.table_of(name.lower())
+                passed = total * selectivity.get(table, 1.0)
+                if match.group(1) == "SCAN":
+                    visits = total
+                else:
+                    constraint = using[using.rfind("(") + 1:using.rfind(")")]
+                    if "PRIMARY KEY" in using or "rowid=" in constraint:
+                        visits = 1.0
+                    elif ">" in constraint and "<" in constraint:
+                        visits = min(passed, total / 64)
+                    elif ">" in constraint or "<" in constraint:
+                        visits = min(passed, total / 4)
+                    else:
+                        visits = min(total, 10.0)
+                    if "AUTOMATIC" in using:
+                        # Built once before the loop starts
+                        result.cost += total
+                    passed = min(passed, visits)
+                result.cost += result.rows * visits
+                result.loops.append((name if table == name.lower() else f"{name} ({table})", visits))
+                result.rows *= max(passed, 1.0)
+        return result
+
+    return level(0)
+
+
+@dataclass(frozen=True)
+class QueryVerdict:
+    """What to do with a generated query: "execute" it, run the "rewrite" in query, or "reject" it."""
+    action: str
+    query: str
+    cost: float
+    reason: str = ""
+    range_join: bool = False
+
+
+def add_time_predicates(sql: str, shape: SqlShape, time_filter: TimeFilter, tables: set[str]) -> str:
+    """Replace references to the given tables with subqueries restricted to the time filter.
+
+    The subquery keeps the table's name (or the alias it had), so column references stay
+    valid, and SQLite flattens it into the outer query so an index on tsStart is still used.
+    """
+    predicate = compile_time_filter("tsStart", time_filter)
+    for ref in sorted(shape.tables, key=lambda r: r.start, reverse=True):
+        if ref.name not in tables:
+            continue
+        replacement = f"(SELECT * FROM {ref.name} WHERE {predicate})"
+        if not ref.has_alias:
+            replacement += f" AS {ref.name}"
+        sql = sql[:ref.start] + replacement + sql[ref.end:]
+    return sql
+
+
+def analyze_query(query: str, explain: Callable[[str], list[tuple]], stats: dict[str, TableStats],
+                  time_filter: Optional[TimeFilter] = None, limit: Optional[int] = None,
+                  max_cost: float = MAX_QUERY_COST) -> QueryVerdict:
+    """Decide from the plan whether a query can run as is, after a safe rewrite, or not at all.
+
+    Queries that cost too much get the planned time filter added to the large tables they
+    scan without one; plain row listings get a LIMIT. Anything else over budget is
+    rejected with a reason the query writer can act on.
+    """
+    shape = parse_sql(query)
+    if shape.statements > 1:
+        return QueryVerdict("reject", query, 0, "Only a single SELECT statement can be executed.")
+    try:
+        plan = explain(query)
+    except Exception as e:
+        return QueryVerdict("reject", query, 0, f"The query is not valid SQLite: {e}")
+
+    selectivity = {name: time_selectivity(stats[name], time_filter)
+                   for name in shape.time_filtered if name in stats}
+    estimate = estimate_plan_cost(plan, shape, stats, selectivity)
+    if estimate.cost <= max_cost:
+        return QueryVerdict("execute", query, estimate.cost)
+
+    unfiltered = {ref.name for ref in shape.tables
+                  if ref.name in TIME_FILTERED_TABLES and ref.name in stats and ref.name not in shape.time_filtered}
+    if time_filter is not None and unfiltered:
+        rewritten = add_time_predicates(query, shape, time_filter, unfiltered)
+        try:
+            rewritten_plan = explain(rewritten)
+        except Exception:
+            rewritten_plan = None
+        if rewritten_plan is not None:
+            selectivity.update({name: time_selectivity(stats[name], time_filter) for name in unfiltered})
+            rewritten_estimate = estimate_plan_cost(rewritten_plan, parse_sql(rewritten), stats, selectivity)
+            if rewritten_estimate.cost <= max_cost:
+                return QueryVerdict("rewrite", rewritten, rewritten_estimate.cost,
+                                    f"Added the time filter to {', '.join(sorted(unfiltered))}.")
+
+    if not shape.aggregates and not estimate.sorts and len(estimate.loops) == 1:
+        # A single loop without sorting stops as soon as the limit is reached
+        if shape.outer_limit:
+            return QueryVerdict("execute", query, estimate.cost)
+        if limit:
+            return QueryVerdict("rewrite", f"SELECT * FROM (\n{query.strip().rstrip(';')}\n) LIMIT {limit}",
+                                estimate.cost, f"Limited the result to {limit} rows.")
+
+    loops = " x ".join(f"{name} ~{visits:,.0f} rows" for name, visits in estimate.loops[:4])
+    reason = f"Estimated cost of {estimate.cost:,.0f} row visits exceeds the budget of {max_cost:,.0f}. Loops: {loops}."
+    if shape.range_join:
+        reason += " Joining on a tsStart BETWEEN range visits every row of one table per row of the other."
+    if unfiltered:
+        reason += f" There is no time filter on {', '.join(sorted(unfiltered))}."
+    return QueryVerdict("reject", query, estimate.cost, reason, shape.range_join)
+
+
+def route_checked_query(state: State) -> str:
+    if state.get("query_error") and state.get("query_attempts", 0) < MAX_QUERY_ATTEMPTS:
+        return "write_query"
+    return "execute_query"
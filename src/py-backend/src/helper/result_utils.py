@@ -1,26 +1,81 @@
+import asyncio
+import io
 import math
+import os
+from typing import Any, Callable, Sequence
+
+from result_table import ResultTable
+
+RESULT_BATCH_ROWS = int(os.getenv("PQ_RESULT_BATCH_ROWS", "2000"))
+FORMAT_BLOCK_ROWS = 1024
+
 
 def escape_md_cell(value: str) -> str:
     return f"`{value.replace('`', '')}`" if "|" in value or "\n" in value else value
 
 
-def format_result_as_markdown(result: list[dict]) -> str:
+def _format_cells(values: Sequence[Any], packed: bool) -> list[str]:
+    # Packed int and float columns never need escaping; other cells only call str() when not a str already
+    if packed:
+        return list(map(str, values.tolist()))
+    return [
+        "None" if value is None
+        else value if type(value) is str and "|" not in value and "\n" not in value
+        else escape_md_cell(str(value))
+        for value in values
+    ]
+
+
+def write_result_markdown(result: ResultTable, write: Callable[[str], Any], max_chars: int | None = None) -> int:
+    """Write the result as a markdown table in blocks of rows and return the number of rows written.
+
+    Stops before the first row that would exceed max_chars and writes a footer with
+    the number of rows left out instead.
+    """
+    header = "| # | " + " | ".join(result.columns) + " |\n" + "| --- " * (len(result.columns) + 1) + "|"
+    write(header)
+    written = len(header)
+    rows = 0
+    for start in range(0, len(result), FORMAT_BLOCK_ROWS):
+        stop = min(start + FORMAT_BLOCK_ROWS, len(result))
+        cells = [_format_cells(result.column(i)[start:stop], bool(result.typecodes[i]))
+                 for i in range(len(result.columns))]
+        lines = ["\n| " + line + " |" for line in map(" | ".join, zip(map(str, range(start + 1, stop + 1)), *cells))]
+        if max_chars is not None:
+            fitting = 0
+            for line in lines:
+                if written + len(line) > max_chars:
+                    break
+                written += len(line)
+                fitting += 1
+            if fitting < len(lines):
+                write("".join(lines[:fitting]))
+                rows += fitting
+                break
+        write("".join(lines))
+        rows += len(lines)
+    if rows < len(result):
+        write(f"\n\n_{len(result) - rows} more rows not shown_")
+    return rows
+
+
+def format_result_as_markdown(result: ResultTable, max_tokens: int | None = None, max_chars: int | None = None) -> str:
     if not result:
         return "No results found"
 
-    headers = list(result[0].keys())
-    headers = ["#"] + headers  # Add row number header
+    if max_tokens is not None:
+        max_chars = min(max_chars or max_tokens * 4, max_tokens * 4)
+    buffer = io.StringIO()
+    write_result_markdown(result, buffer.write, max_chars)
+    return buffer.getvalue()
 
-    lines = ["| " + " | ".join(headers) + " |", "| " + " | ".join(["---"] * len(headers)) + " |"]
 
-    for idx, row in enumerate(result, start=1):
-        row_values = [str(idx)] + [escape_md_cell(str(value)) for value in row.values()]
-        lines.append("| " + " | ".join(row_values) + " |")
+def format_result_chunks(result: ResultTable) -> list[str]:
+    """Markdown of the result split into chunks for the answer prompts."""
+    return [format_result_as_markdown(chunk) for chunk in split_result(result)]
 
-    return "\n".join(lines)
 
-
-def split_result(data: list[dict], max_chunk_size: int = 5000) -> list[list[dict]]:
+def split_result(data: ResultTable, max_chunk_size: int = 5000) -> list[ResultTable]:
     """
     Splits data into evenly sized chunks where each chunk has <= max_entries.
     """
@@ -33,4 +88,20 @@ def split_result(data: list[dict], max_chunk_size: int = 5000) -> list[list[dict
         if chunk_size <= max_chunk_size:
             break
 
-    return [data[i * chunk_size:(i + 1) * chunk_size] for i in range(num_chunks)]
+    return [data.slice(i * chunk_size, (i + 1) * chunk_size) for i in range(num_chunks)]
+
+
+async def stream_result(websocket, rows: ResultTable, batch_rows: int = RESULT_BATCH_ROWS):
+    """Send rows as column-array batches followed by a result_end frame.
+
+    Each send is awaited before the next batch is built, so a slow client throttles
+    the producer instead of the whole result being queued in memory at once.
+    """
+    for offset in range(0, len(rows), batch_rows):
+        await websocket.send_json({
+            "type": "result_batch",
+            "offset": offset,
+            "values": rows.slice(offset, offset + batch_rows).to_json()["values"]
+        })
+        await asyncio.sleep(0)
+    await websocket.send_json({"type": "result_end", "row_count": len(rows)})
@@ -243,3 +243,213 @@ ORDER BY
 ]
 
 
+# Hourly rollups in the attached analytics database (see analytics_db.AnalyticsDB), used
+# instead of the templates above when they are up to date. Their `hour` column
+# ('YYYY-MM-DD HH:00:00') takes the place of tsStart in time groupings and filters.
+rollup_sql_templates = [
+    {
+        "feature": AggregationFeature.context_switch,
+        "sql_template": """
+SELECT
+  {time_grouping} AS {time_bucket},
+  from_activity AS "From",
+  to_activity AS "To",
+  SUM(switch_count) AS switch_count
+FROM analytics.rollup_context_switch_hourly
+WHERE {time_filter}
+  AND {additional_conditions}
+GROUP BY time_bucket, from_activity, to_activity
+ORDER BY time_bucket ASC, switch_count DESC;
+""".strip()
+    },
+    {
+        "feature": AggregationFeature.total_focus_time,
+        "sql_template": """
+SELECT
+  {time_grouping} AS {time_bucket},
+  activity,
+  processName,
+  SUM(durationInSeconds) AS total_focus_time_in_s
+FROM analytics.rollup_window_activity_hourly
+WHERE
+  {time_filter}
+  AND {additional_conditions}
+GROUP BY
+  time_bucket,
+  activity,
+  processName
+ORDER BY
+  time_bucket ASC,
+  total_focus_time_in_s DESC;
+""".strip()
+    },
+    {
+        "feature": AggregationFeature.input_activity_volume,
+        "sql_template": """
+SELECT
+  {time_grouping} AS {time_bucket},
+  SUM(keysTotal) AS total_keystrokes,
+  SUM(clickTotal) AS total_clicks,
+  ROUND(SUM(movedDistance), 2) AS total_mouse_movement,
+  ROUND(SUM(scrollDelta), 2) AS total_scroll
+FROM analytics.rollup_user_input_hourly
+WHERE
+  {time_filter}
+  AND {additional_conditions}
+GROUP BY
+  time_bucket
+ORDER BY
+  time_bucket ASC;
+""".strip()
+    }
+]
+
+# The templates above with their tsStart BETWEEN range joins replaced by equi-joins on the
+# interval maps in the attached analytics database (see analytics_db.refresh_interval_maps).
+interval_join_sql_templates = [
+    {
+        "feature": AggregationFeature.user_input_by_app,
+        "sql_template": """
+SELECT
+  {time_grouping} AS {time_bucket},
+  w.activity,
+  w.processName,
+  SUM(u.keysTotal) AS total_keystrokes,
+  SUM(u.clickTotal) AS total_clicks,
+  ROUND(SUM(u.movedDistance), 2) AS total_mouse_movement,
+  ROUND(SUM(u.scrollDelta), 2) AS total_scroll
+FROM user_input u
+JOIN analytics.user_input_interval_map m
+  ON m.user_input_id = u.id
+JOIN window_activity w
+  ON w.id = m.window_activity_id
+WHERE
+  {time_filter}
+  AND {additional_conditions}
+GROUP BY
+  time_bucket,
+  w.activity,
+  w.processName
+ORDER BY
+  time_bucket ASC,
+  total_keystrokes DESC;
+""".strip()
+    },
+    {
+        "feature": AggregationFeature.work_related_typing,
+        "sql_template": """
+SELECT
+  {time_grouping} AS {time_bucket},
+  ROUND(
+    SUM(u.keysTotal) * 1.0 /
+    SUM(w.durationInSeconds),
+    2
+  ) AS typing_productivity
+FROM user_input u
+JOIN analytics.user_input_interval_map m
+  ON m.user_input_id = u.id
+JOIN window_activity w
+  ON w.id = m.window_activity_id
+WHERE
+  {time_filter}
+  AND u.keysTotal > 0
+  AND {additional_conditions}
+GROUP BY
+  time_bucket
+ORDER BY
+  time_bucket ASC;
+""".strip()
+    },
+    {
+        "feature": AggregationFeature.input_activity_by_productivity,
+        "sql_template": """
+SELECT
+  {time_grouping} AS {time_bucket},
+  s.response AS productivity_rating,
+  {aggregation_fields}
+FROM session s
+JOIN analytics.user_input_interval_map m
+  ON m.session_id = s.id
+JOIN user_input u
+  ON u.id = m.user_input_id
+WHERE
+  {time_filter}
+  AND {additional_conditions}
+GROUP BY
+  time_bucket,
+  s.response
+ORDER BY
+  time_bucket ASC,
+  s.response ASC;
+""".strip()
+    },
+    {
+        "feature": AggregationFeature.activity_time_by_productivity,
+        "sql_template": """
+SELECT
+  {time_grouping} AS {time_bucket},
+  s.response AS productivity_rating,
+  {aggregation_fields}
+FROM session s
+JOIN analytics.window_activity_session_map m
+  ON m.session_id = s.id
+JOIN window_activity w
+  ON w.id = m.window_activity_id
+WHERE
+  {time_filter}
+  AND {additional_conditions}
+GROUP BY
+  time_bucket,
+  s.response
+ORDER BY
+  time_bucket ASC,
+  s.response ASC;
+""".strip()
+    },
+    {
+        "feature": AggregationFeature.session_activity_input_summary,
+        "sql_template": """
+WITH window_activity_agg AS (
+  SELECT
+    s.id AS session_id,
+    {time_grouping} AS {time_bucket},
+    {window_aggregations}
+  FROM session s
+  JOIN analytics.window_activity_session_map wm
+    ON wm.session_id = s.id
+  JOIN window_activity w
+    ON w.id = wm.window_activity_id
+  WHERE {time_filter}
+    AND {additional_conditions}
+  GROUP BY s.id, time_bucket
+),
+user_input_agg AS (
+  SELECT
+    s.id AS session_id,
+    {time_grouping} AS {time_bucket},
+    {user_aggregations}
+  FROM session s
+  JOIN analytics.user_input_interval_map um
+    ON um.session_id = s.id
+  JOIN user_input u
+    ON u.id = um.user_input_id
+  WHERE {time_filter}
+    AND {additional_conditions}
+  GROUP BY s.id, time_bucket
+)
+SELECT
+  wa.time_bucket,
+  s.response AS productivity_rating,
+  {final_select_fields}
+FROM window_activity_agg wa
+LEFT JOIN user_input_agg ui
+  ON wa.session_id = ui.session_id
+  AND wa.time_bucket = ui.time_bucket
+JOIN session s
+  ON s.id = wa.session_id
+ORDER BY
+  wa.time_bucket ASC,
+  s.response ASC;
+""".strip()
+    }
+]
@@ -0,0 +1,152 @@
+import os
+import re
+from datetime import date, timedelta
+from typing import Iterable, Optional
+
+from schemas import Activity, AggregationFeature, TimeFilter, TimeGrouping
+
+COMPILER_ENABLED = os.getenv("PQ_SQL_COMPILER", "1") == "1"
+
+browser_activities = {
+    Activity.WorkRelatedBrowsing,
+    Activity.WorkUnrelatedBrowsing
+}
+browser_process_list = [
+    "Brave Browser",
+    "Firefox",
+    "Microsoft Edge",
+    "Google Chrome",
+    "Safari",
+    "Opera",
+    "Opera GX",
+    "Chromium",
+    "Vivaldi",
+    "Tor Browser",
+]
+
+# Per feature: the column time groupings and filters apply to, and the alias prefix of
+# window_activity where {additional_conditions} is placed (None: no window_activity there,
+# so an activity filter cannot be compiled).
+FEATURE_COLUMNS = {
+    AggregationFeature.context_switch: ("tsStart", ""),
+    AggregationFeature.total_focus_time: ("tsStart", ""),
+    AggregationFeature.input_activity_volume: ("tsStart", None),
+    AggregationFeature.typing_streaks: ("tsStart", None),
+    AggregationFeature.typing_gaps: ("tsStart", None),
+    AggregationFeature.user_input_by_app: ("u.tsStart", "w."),
+    AggregationFeature.work_related_typing: ("u.tsStart", "w."),
+    AggregationFeature.input_activity_by_productivity: ("s.tsStart", None),
+    AggregationFeature.activity_time_by_productivity: ("s.tsStart", "w."),
+    AggregationFeature.session_activity_input_summary: ("s.tsStart", None),
+}
+
+# The rollups have an `hour` column instead of tsStart; context switches only keep the
+# activity pair, which is not the same as filtering activities before the LAG.
+ROLLUP_COLUMNS = {
+    AggregationFeature.context_switch: ("hour", None),
+    AggregationFeature.total_focus_time: ("hour", ""),
+    AggregationFeature.input_activity_volume: ("hour", None),
+}
+
+# Fields the LLM would otherwise choose for the templates with open select lists
+DEFAULT_FIELDS = {
+    AggregationFeature.input_activity_by_productivity: {
+        "aggregation_fields": "SUM(u.keysTotal) AS total_keystrokes,\n"
+                              "  SUM(u.clickTotal) AS total_clicks,\n"
+                              "  ROUND(SUM(u.movedDistance), 2) AS total_mouse_movement,\n"
+                              "  ROUND(SUM(u.scrollDelta), 2) AS total_scroll"
+    },
+    AggregationFeature.activity_time_by_productivity: {
+        "aggregation_fields": "SUM(w.durationInSeconds) AS total_activity_time_in_s,\n"
+                              "  COUNT(DISTINCT w.processName) AS distinct_apps"
+    },
+    AggregationFeature.session_activity_input_summary: {
+        "window_aggregations": "SUM(w.durationInSeconds) AS total_activity_time_in_s,\n"
+                               "    COUNT(DISTINCT w.activity) AS distinct_activities",
+        "user_aggregations": "SUM(u.keysTotal) AS total_keystrokes,\n"
+                             "    SUM(u.clickTotal) AS total_clicks",
+        "final_select_fields": "wa.total_activity_time_in_s,\n"
+                               "  wa.distinct_activities,\n"
+                               "  COALESCE(ui.total_keystrokes, 0) AS total_keystrokes,\n"
+                               "  COALESCE(ui.total_clicks, 0) AS total_clicks"
+    },
+}
+
+# Same granularity as group_based_on_time_scope() asks the LLM for; sessions are short
+# enough to be grouped by hour.
+TIME_GROUPINGS = {
+    TimeGrouping.session: ("hour", "strftime('%Y-%m-%d %H:00', {column})"),
+    TimeGrouping.day: ("hour", "strftime('%Y-%m-%d %H:00', {column})"),
+    TimeGrouping.week: ("day", "date({column})"),
+    TimeGrouping.month: ("week", "strftime('%Y-W%W', {column})"),
+}
+
+_PLACEHOLDER = re.compile(r"\{\w+\}")
+_TIME_BUCKET = re.compile(r"\btime_bucket\b")
+
+
+def _quote(value: str) -> str:
+    return "'" + value.replace("'", "''") + "'"
+
+
+def _date_range(column: str, first: date, last: date) -> str:
+    # Plain comparisons on the stored text keep an index on the column usable
+    return f"{column} >= '{first.isoformat()}' AND {column} < '{(last + timedelta(days=1)).isoformat()}'"
+
+
+def compile_time_filter(column: str, time_filter: Optional[TimeFilter]) -> Optional[str]:
+    if time_filter is None:
+        return None
+    if time_filter.type == "single":
+        return _date_range(column, time_filter.date, time_filter.date)
+    if time_filter.type == "range":
+        return _date_range(column, time_filter.from_date, time_filter.to_date)
+    if time_filter.type == "multiple" and time_filter.dates:
+        return "(" + " OR ".join(f"({_date_range(column, d, d)})" for d in sorted(set(time_filter.dates))) + ")"
+    return None
+
+
+def compile_activity_filter(activities: Optional[Iterable[Activity]], prefix: Optional[str]) -> Optional[str]:
+    """The activity filter get_custom_table_info() describes to the LLM, as SQL."""
+    activities = list(activities or [])
+    if not activities:
+        return "1 = 1"
+    if prefix is None:
+        return None
+    if set(activities) == browser_activities:
+        return f"{prefix}processName IN ({', '.join(_quote(p) for p in browser_process_list)})"
+    return f"{prefix}activity IN ({', '.join(_quote(a.name) for a in activities)})"
+
+
+def compile_aggregation_query(template: str, source: str, feature: AggregationFeature,
+                              time_grouping: Optional[TimeGrouping], time_filter: Optional[TimeFilter],
+                              activities: Optional[Iterable[Activity]]) -> Optional[str]:
+    """Fill an aggregation template without the LLM.
+
+    `source` is "rollup" for the hourly rollup templates and anything else for templates
+    on the tracker's tables. Returns None when the scope cannot be expressed exactly, in
+    which case the query is left to the LLM.
+    """
+    columns = ROLLUP_COLUMNS if source == "rollup" else FEATURE_COLUMNS
+    if feature not in columns:
+        return None
+    time_column, window_prefix = columns[feature]
+
+    time_filter_sql = compile_time_filter(time_column, time_filter)
+    conditions = compile_activity_filter(activities, window_prefix)
+    if time_filter_sql is None or conditions is None:
+        return None
+
+    bucket, grouping = TIME_GROUPINGS[time_grouping or TimeGrouping.day]
+    values = {
+        "time_grouping": grouping.format(column=time_column),
+        "time_bucket": bucket,
+        "time_filter": time_filter_sql,
+        "additional_conditions": conditions,
+        **DEFAULT_FIELDS.get(feature, {}),
+    }
+    query = _PLACEHOLDER.sub(lambda m: values.get(m.group()[1:-1], m.group()), template)
+    if _PLACEHOLDER.search(query):
+        return None
+    # The templates group and order by the literal name of the {time_bucket} alias
+    return _TIME_BUCKET.sub(bucket, query)
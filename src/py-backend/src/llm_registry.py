@@ -1,11 +1,17 @@
 from langchain_openai import ChatOpenAI
 
+from llm_cache import LLMResponseCache
+
 
 class LLMRegistry:
     _llms: dict[str, ChatOpenAI] = {}
+    _cache: LLMResponseCache | None = None
 
     @classmethod
     def register(cls, name: str, llm: ChatOpenAI):
+        # Only deterministic models are safe to answer from the cache
+        if llm.temperature == 0:
+            llm.cache = cls.get_cache()
         cls._llms[name] = llm
 
     @classmethod
@@ -13,3 +19,13 @@ class LLMRegistry:
         if name not in cls._llms:
             raise ValueError(f"LLM '{name}' not registered.")
         return cls._llms[name]
+
+    @classmethod
+    def get_cache(cls) -> LLMResponseCache:
+        if cls._cache is None:
+            cls._cache = LLMResponseCache()
+        return cls._cache
+
+    @classmethod
+    def cache_stats(cls) -> dict:
+        return cls.get_cache().stats()
@@ -1,11 +1,17 @@
+import os
 import signal
 import logging
 import asyncio
 import sys
+import time
+
+_process_start = time.perf_counter()
 
 from uvicorn import Config, Server
 from server_rest import app
 
+_import_done = time.perf_counter()
+
 logging.basicConfig(
     format="%(asctime)s - %(levelname)s - %(message)s",
     datefmt="%Y-%m-%d %H:%M:%S",
@@ -16,6 +22,15 @@ logging.debug("Starting main script import...")
 
 server = None
 
+# Set PQ_STARTUP_REPORT=1 to start the backend, report startup timings once /health
+# is served and exit. A non-zero exit code signals that PQ_STARTUP_BUDGET_MS was exceeded.
+STARTUP_REPORT = os.getenv("PQ_STARTUP_REPORT") == "1"
+STARTUP_BUDGET_MS = float(os.getenv("PQ_STARTUP_BUDGET_MS", "3000"))
+
+# Modules that must not be imported before the first plot request
+DEFERRED_MODULES = ["matplotlib", "seaborn", "pandas", "plotly"]
+_deferred_loaded_at_import = [m for m in DEFERRED_MODULES if m in sys.modules]
+
 
 def handle_exit(signum, frame):
     logging.info(f"Received exit signal ({signum})")
@@ -26,6 +41,28 @@ def handle_exit(signum, frame):
     loop.stop()
 
 
+async def report_startup() -> bool:
+    """Wait for the server to come up and log how long startup took."""
+    while not server.started:
+        await asyncio.sleep(0.01)
+    ready = time.perf_counter()
+
+    import_ms = (_import_done - _process_start) * 1000
+    ready_ms = (ready - _process_start) * 1000
+    logging.info(f"[startup] import server_rest: {import_ms:.0f} ms")
+    logging.info(f"[startup] time to /health: {ready_ms:.0f} ms (budget {STARTUP_BUDGET_MS:.0f} ms)")
+
+    within_budget = ready_ms <= STARTUP_BUDGET_MS
+    if _deferred_loaded_at_import:
+        logging.warning(f"[startup] deferred modules imported at startup: {', '.join(_deferred_loaded_at_import)}")
+        within_budget = False
+    if not within_budget:
+        logging.warning("[startup] startup budget exceeded")
+
+    server.should_exit = True
+    return within_budget
+
+
 async def main():
     global server
     config = Config(
@@ -38,10 +75,14 @@ async def main():
     )
     server = Server(config)
 
+    report = asyncio.create_task(report_startup()) if STARTUP_REPORT else None
+
     # Start server. This coroutine completes when server.should_exit becomes True
     await server.serve()
 
     logging.info("Server shutdown complete. Exiting process.")
+    if report and report.done() and not report.result():
+        sys.exit(1)
     sys.exit(0)
 
 
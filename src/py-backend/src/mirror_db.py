@@ -0,0 +1,142 @@
+import logging
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict
+
+MIRROR_TABLES = ("window_activity", "user_input", "session")
+
+# Unix epoch seconds of the datetime columns, so queries need no strftime('%s', ...) per row
+EPOCH_COLUMNS = {"tsStartEpoch": "tsStart", "tsEndEpoch": "tsEnd"}
+
+MIRROR_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_window_activity_ts ON window_activity (tsStart, activity, processName, durationInSeconds)",
+    "CREATE INDEX IF NOT EXISTS idx_window_activity_activity ON window_activity (activity, tsStart)",
+    "CREATE INDEX IF NOT EXISTS idx_window_activity_process ON window_activity (processName, tsStart)",
+    "CREATE INDEX IF NOT EXISTS idx_window_activity_epoch ON window_activity (tsStartEpoch, tsEndEpoch)",
+    "CREATE INDEX IF NOT EXISTS idx_user_input_ts ON user_input (tsStart, keysTotal, clickTotal, movedDistance, scrollDelta)",
+    "CREATE INDEX IF NOT EXISTS idx_user_input_epoch ON user_input (tsStartEpoch, tsEndEpoch)",
+    "CREATE INDEX IF NOT EXISTS idx_session_ts ON session (tsStart, tsEnd, response)",
+]
+
+
+def _epoch(column: str) -> str:
+    return f"CAST(strftime('%s', {column}) AS INTEGER)"
+
+
+class MirrorDB:
+    """Indexed local copy of the PersonalAnalytics database.
+
+    The tracker's database is opened read-only and without the indexes generated queries
+    need. The mirror is created with the SQLite backup API, extended with epoch columns
+    and covering indexes, and then kept up to date by copying rows from the newest
+    tsStart on. Rows the tracker deleted (e.g. through its obfuscation tools) show up as
+    a row count mismatch and trigger a full copy.
+    """
+
+    def __init__(self, source: Path, path: Path, min_interval_seconds: float):
+        self.source = source
+        self.path = path
+        self.min_interval_seconds = min_interval_seconds
+        self._lock = threading.Lock()
+        self._last_sync = 0.0
+        self._synced_version = None
+
+    def _connect_source(self) -> sqlite3.Connection:
+        return sqlite3.connect(f"file:{self.source}?mode=ro", uri=True, check_same_thread=False)
+
+    def _connect(self, path: Path) -> sqlite3.Connection:
+        conn = sqlite3.connect(str(path), uri=True, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    @staticmethod
+    def _prepare(conn: sqlite3.Connection):
+        """Add and fill the epoch columns and create the indexes on a fresh copy."""
+        for table in MIRROR_TABLES:
+            columns = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+            for epoch_column, source_column in EPOCH_COLUMNS.items():
+                if source_column in columns and epoch_column not in columns:
+                    conn.execute(f"ALTER TABLE {table} ADD COLUMN {epoch_column} INTEGER")
+                    conn.execute(f"UPDATE {table} SET {epoch_column} = {_epoch(source_column)}")
+        for statement in MIRROR_INDEXES:
+            try:
+                conn.execute(statement)
+            except sqlite3.OperationalError as e:
+                logging.warning(f"[MirrorDB] Skipping index: {e}")
+        conn.commit()
+        conn.execute("ANALYZE")
+        conn.commit()
+
+    def _full_copy(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        staging_path = self.path.with_suffix(".staging.db")
+        staging_path.unlink(missing_ok=True)
+        source = self._connect_source()
+        staging = sqlite3.connect(str(staging_path))
+        try:
+            source.backup(staging)
+            self._prepare(staging)
+            staging.execute("PRAGMA journal_mode=WAL")
+            if not self.path.exists():
+                staging.close()
+                staging_path.replace(self.path)
+                return
+            # Copying the finished staging file in one step means readers never see a half-built mirror
+            mirror = self._connect(self.path)
+            try:
+                staging.backup(mirror)
+            finally:
+                mirror.close()
+        finally:
+            source.close()
+            staging.close()
+            staging_path.unlink(missing_ok=True)
+
+    def _copy_new_rows(self) -> bool:
+        """Copy rows from the newest mirrored tsStart on; returns False if a full copy is needed."""
+        conn = self._connect(self.path)
+        try:
+            conn.execute("ATTACH DATABASE ? AS src", (f"file:{self.source}?mode=ro",))
+            with conn:
+                for table in MIRROR_TABLES:
+                    source_columns = [row[1] for row in conn.execute(f"PRAGMA src.table_info({table})")]
+                    mirror_columns = {row[1] for row in conn.execute(f"PRAGMA main.table_info({table})")}
+                    if not source_columns or not set(source_columns) <= mirror_columns:
+                        return False
+                    watermark = conn.execute(f"SELECT COALESCE(MAX(tsStart), '') FROM main.{table}").fetchone()[0]
+                    epoch_columns = [c for c, source_column in EPOCH_COLUMNS.items() if source_column in source_columns]
+                    column_list = ", ".join(source_columns + epoch_columns)
+                    select_list = ", ".join(source_columns + [_epoch(EPOCH_COLUMNS[c]) for c in epoch_columns])
+                    # Rows at the watermark are copied again, which picks up a tsEnd updated in place
+                    conn.execute(f"""
+                        INSERT OR REPLACE INTO main.{table} ({column_list})
+                        SELECT {select_list} FROM src.{table} WHERE tsStart >= ?
+                    """, (watermark,))
+                    source_count = conn.execute(f"SELECT COUNT(*) FROM src.{table}").fetchone()[0]
+                    mirror_count = conn.execute(f"SELECT COUNT(*) FROM main.{table}").fetchone()[0]
+                    if source_count != mirror_count:
+                        return False
+            return True
+        finally:
+            conn.close()
+
+    def sync(self, version) -> Dict:
+        """Bring the mirror up to date unless it was synced recently or the source is unchanged."""
+        with self._lock:
+            if version == self._synced_version and self.path.exists():
+                return {}
+            if time.monotonic() - self._last_sync < self.min_interval_seconds and self.path.exists():
+                return {}
+            start = time.perf_counter()
+            mode = "incremental"
+            if not self.path.exists() or not self._copy_new_rows():
+                mode = "full"
+                self._full_copy()
+            self._synced_version = version
+            self._last_sync = time.monotonic()
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            logging.info(f"[MirrorDB] {mode} sync in {elapsed_ms:.0f} ms")
+            return {"mode": mode, "ms": elapsed_ms}
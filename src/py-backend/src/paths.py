@@ -0,0 +1,14 @@
+import os
+import sys
+from pathlib import Path
+
+
+def get_app_data_dir() -> Path:
+    # Benchmarks and tests point this at a throwaway directory, also on macOS
+    override = os.getenv("PQ_APP_DATA_DIR")
+    if override:
+        return Path(override)
+    if sys.platform == "darwin":
+        return Path.home() / "Library" / "Application Support" / "personal-query"
+    else:
+        return Path(os.getenv("APPDATA", Path.home())) / "personal-query"
@@ -0,0 +1,233 @@
+import hashlib
+import json
+import logging
+import sys
+import threading
+from datetime import datetime, UTC
+from pathlib import Path
+
+from langchain_core.load import dumpd, load
+from langchain_core.prompts import BasePromptTemplate
+
+from paths import get_app_data_dir
+from prompt_templates import LOCAL_PROMPTS
+
+BUNDLE_VERSION = 1
+BUNDLE_FILENAME = "prompt_bundle.json"
+
+PROMPT_NAMES = [
+    "activity_selection",
+    "generate_answer",
+    "answer-diagnostic",
+    "answer-predictive",
+    "answer-prescriptive",
+    "answer-descriptive",
+    "answer-diagnostic-plot",
+    "answer-predictive-plot",
+    "answer-prescriptive-plot",
+    "answer-descriptive-plot",
+    "general_answer",
+    "give_context",
+    "classify_question",
+    "generate_title",
+    "auto-plot-decision",
+    "create-plot-py",
+    "create-plot-py-again",
+    "sql-query-system-prompt",
+    "diagnostic-sql-query",
+    "predictive-sql-query",
+    "prescriptive-sql-query",
+    "descriptive-sql-query",
+    "user_input",
+    "window_activity",
+    "session",
+    "adjust-query-decision",
+    "adjust-query",
+    "correct-query",
+    "get_scope",
+    "get_relevant_tables",
+]
+
+
+def check_input_variables(name: str, template: BasePromptTemplate, expected: set[str]):
+    """Fail on a template whose variables differ from the ones the chains pass to it."""
+    declared = set(template.input_variables)
+    if declared != expected:
+        raise ValueError(f"Prompt '{name}' declares the variables {sorted(declared)}, "
+                         f"but the chains pass {sorted(expected)}")
+
+
+# Checked on import, so a broken template fails at startup instead of on first use
+for _name, (_template, _variables) in LOCAL_PROMPTS.items():
+    check_input_variables(_name, _template, _variables)
+
+
+def _shipped_bundle_path() -> Path:
+    """Bundle shipped next to the sources (or inside the PyInstaller archive)."""
+    if getattr(sys, 'frozen', False):
+        base_path = Path(getattr(sys, '_MEIPASS', Path(sys.executable).parent))
+    else:
+        base_path = Path(__file__).resolve().parent
+    return base_path / "prompts" / BUNDLE_FILENAME
+
+
+def _refreshed_bundle_path() -> Path:
+    """Writable copy updated by the background hub refresh."""
+    return get_app_data_dir() / "prompts" / BUNDLE_FILENAME
+
+
+def _read_bundle(path: Path) -> dict:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            bundle = json.load(f)
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        logging.warning(f"[PromptStore] Ignoring unreadable prompt bundle {path}: {e}")
+        return {}
+
+    if bundle.get("bundle_version") != BUNDLE_VERSION:
+        logging.warning(f"[PromptStore] Ignoring prompt bundle {path} with version {bundle.get('bundle_version')}")
+        return {}
+    return bundle.get("prompts", {})
+
+
+def _write_bundle(path: Path, prompts: dict):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({
+            "bundle_version": BUNDLE_VERSION,
+            "created_at": datetime.now(UTC).isoformat(),
+            "prompts": prompts
+        }, f, indent=1)
+    tmp_path.replace(path)
+
+
+def _bundle_entry(prompt: BasePromptTemplate) -> dict:
+    serialized = dumpd(prompt)
+    digest = hashlib.sha256(json.dumps(serialized, sort_keys=True).encode("utf-8")).hexdigest()
+    return {"sha256": digest, "fetched_at": datetime.now(UTC).isoformat(), "prompt": serialized}
+
+
+class PromptStore:
+    """Serves LangChain hub prompts from a local, versioned bundle.
+
+    Templates are deserialized on first use. The refreshed copy in the app data
+    directory takes precedence over the shipped bundle; the hub is only hit
+    synchronously if neither contains the requested prompt. Prompts in
+    prompt_templates.LOCAL_PROMPTS are served from the repository instead.
+    """
+    _entries: dict[str, dict] | None = None
+    _templates: dict[str, BasePromptTemplate] = {}
+    _lock = threading.Lock()
+
+    @classmethod
+    def _load_entries(cls) -> dict[str, dict]:
+        if cls._entries is None:
+            entries = _read_bundle(_shipped_bundle_path())
+            entries.update(_read_bundle(_refreshed_bundle_path()))
+            if not entries:
+                # Only packaged builds ship a bundle; dev runs fall back to the hub until refreshed
+                logging.warning(f"[PromptStore] No prompt bundle at {_shipped_bundle_path()} or "
+                                f"{_refreshed_bundle_path()}, prompts are pulled from the hub on first use. "
+                                f"Run 'python prompt_store.py' to export one.")
+            cls._entries = entries
+        return cls._entries
+
+    @classmethod
+    def get(cls, name: str) -> BasePromptTemplate:
+        if name in LOCAL_PROMPTS:
+            return LOCAL_PROMPTS[name][0]
+        template = cls._templates.get(name)
+        if template is not None:
+            return template
+
+        with cls._lock:
+            if name in cls._templates:
+                return cls._templates[name]
+
+            entry = cls._load_entries().get(name)
+            if entry is not None:
+                template = load(entry["prompt"])
+            else:
+                logging.warning(f"[PromptStore] Prompt '{name}' missing from local bundle, pulling from hub")
+                from langchain import hub
+                template = hub.pull(name)
+
+            cls._templates[name] = template
+            return template
+
+    @classmethod
+    def lazy(cls, name: str) -> "LazyPrompt":
+        return LazyPrompt(name)
+
+    @classmethod
+    def refresh(cls, names: list[str] = None):
+        """Pull the given prompts from the hub and persist them to the refreshed bundle.
+
+        Already loaded templates stay in use until the next start so a running chat
+        never sees a prompt change mid-turn.
+        """
+        from langchain import hub
+
+        names = names or PROMPT_NAMES
+        entries = dict(_read_bundle(_refreshed_bundle_path()))
+        changed = False
+        for name in names:
+            try:
+                entry = _bundle_entry(hub.pull(name))
+            except Exception as e:
+                logging.warning(f"[PromptStore] Could not refresh prompt '{name}': {e}")
+                continue
+            if entries.get(name, {}).get("sha256") != entry["sha256"]:
+                entries[name] = entry
+                changed = True
+
+        if changed:
+            _write_bundle(_refreshed_bundle_path(), entries)
+            logging.info("[PromptStore] Refreshed prompt bundle from hub")
+
+    @classmethod
+    def refresh_in_background(cls) -> threading.Thread:
+        thread = threading.Thread(target=cls.refresh, name="prompt-refresh", daemon=True)
+        thread.start()
+        return thread
+
+
+class LazyPrompt:
+    """Stand-in for a prompt template that is resolved on first use."""
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def _template(self) -> BasePromptTemplate:
+        return PromptStore.get(self.name)
+
+    def invoke(self, *args, **kwargs):
+        return self._template().invoke(*args, **kwargs)
+
+    async def ainvoke(self, *args, **kwargs):
+        return await self._template().ainvoke(*args, **kwargs)
+
+    def __or__(self, other):
+        return self._template() | other
+
+    def __getattr__(self, item):
+        return getattr(self._template(), item)
+
+
+def export_bundle(path: Path = None):
+    """Pull every known prompt from the hub into the bundle shipped with the backend."""
+    from langchain import hub
+
+    path = path or _shipped_bundle_path()
+    _write_bundle(path, {name: _bundle_entry(hub.pull(name)) for name in PROMPT_NAMES})
+    print(f"Exported {len(PROMPT_NAMES)} prompts to {path}")
+
+
+if __name__ == "__main__":
+    from helper.env_loader import load_env
+
+    load_env()
+    export_bundle()
@@ -0,0 +1,46 @@
+from langchain_core.prompts import ChatPromptTemplate
+
+# Prompts kept in the repository instead of the hub. PromptStore serves these before any
+# bundle, and every template must declare exactly the variables the chains pass to it.
+
+partial_answer = ChatPromptTemplate.from_messages([("system", """\
+You are answering a question about the user's computer interaction data. The result of the SQL \
+query below is too large to answer at once, so it was split into parts that are answered separately \
+and combined afterwards.
+
+Question: {question}
+
+SQL query:
+{query}
+
+This is part {chunk_index} of {chunk_count} of the result:
+{result}
+
+Answer the question using only this part of the result. Report the counts, totals, time ranges and \
+notable rows needed to combine your answer with the answers for the other parts, and state their \
+units. Do not guess what the other parts contain and do not write an introduction or a conclusion.""")])
+
+summarize_answers = ChatPromptTemplate.from_messages([("system", """\
+You are answering a question about the user's computer interaction data. The result of the SQL \
+query below was too large to answer at once, so each part of it was answered separately.
+
+Question: {question}
+
+SQL query:
+{query}
+
+Answers for the parts of the result:
+{answers}
+
+Combine them into one answer to the question:
+- Add up counts and totals across the parts instead of listing them per part, and mention \
+neither the parts nor how the result was split.
+- Only use information contained in the answers above.
+{plot_code}
+{granularity_instruction}""")])
+
+LOCAL_PROMPTS = {
+    "partial_answer": (partial_answer, {"question", "query", "result", "chunk_index", "chunk_count"}),
+    "summarize_answers": (summarize_answers, {"question", "query", "answers", "plot_code",
+                                              "granularity_instruction"}),
+}
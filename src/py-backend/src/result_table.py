@@ -0,0 +1,139 @@
+from array import array
+from dataclasses import dataclass, field
+from itertools import islice
+from typing import Any, Iterator, Sequence
+
+# Columns whose values all share one of these types are packed into a typed buffer
+_TYPECODES = {int: "q", float: "d"}
+_NUMPY_DTYPES = {"q": "int64", "d": "float64"}
+
+
+def _pack_column(values: Sequence[Any]) -> tuple[str, bytes | list]:
+    if values:
+        value_type = type(values[0])
+        typecode = _TYPECODES.get(value_type)
+        if typecode and all(type(value) is value_type for value in values):
+            try:
+                return typecode, array(typecode, values).tobytes()
+            except OverflowError:
+                pass
+    return "", list(values)
+
+
+@dataclass(frozen=True)
+class ResultTable:
+    """Query result stored column by column.
+
+    Integer and float columns without NULLs are packed into bytes and read through a
+    typed memoryview; all other columns are plain lists. Plain bytes and lists keep the
+    table serializable by the checkpointer without a per-row dict for every record.
+    """
+    columns: list[str] = field(default_factory=list)
+    typecodes: list[str] = field(default_factory=list)
+    data: list[bytes | list] = field(default_factory=list)
+    row_count: int = 0
+
+    @classmethod
+    def empty(cls) -> "ResultTable":
+        return cls()
+
+    @classmethod
+    def from_rows(cls, columns: list[str], rows: Sequence[Sequence[Any]]) -> "ResultTable":
+        """Build a table from cursor rows (tuples in column order)."""
+        if not rows:
+            return cls(list(columns), [""] * len(columns), [[] for _ in columns], 0)
+        packed = [_pack_column(values) for values in zip(*rows)]
+        return cls(list(columns), [p[0] for p in packed], [p[1] for p in packed], len(rows))
+
+    @classmethod
+    def from_columns(cls, columns: list[str], values: Sequence[Sequence[Any]]) -> "ResultTable":
+        packed = [_pack_column(list(column_values)) for column_values in values]
+        row_count = len(values[0]) if values else 0
+        return cls(list(columns), [p[0] for p in packed], [p[1] for p in packed], row_count)
+
+    @classmethod
+    def from_records(cls, records: list[dict]) -> "ResultTable":
+        """Build a table from per-row dicts, e.g. rows edited and posted back by the client."""
+        if not records:
+            return cls.empty()
+        columns = list(records[0].keys())
+        return cls.from_columns(columns, [[record.get(column) for record in records] for column in columns])
+
+    @classmethod
+    def from_json(cls, payload) -> "ResultTable":
+        """Inverse of to_json(); also accepts the list of records stored by older versions."""
+        if isinstance(payload, list):
+            return cls.from_records(payload)
+        return cls.from_columns(payload["columns"], payload["values"])
+
+    def __len__(self) -> int:
+        return self.row_count
+
+    def column(self, index: int) -> Sequence[Any]:
+        typecode = self.typecodes[index]
+        if typecode:
+            return memoryview(self.data[index]).cast(typecode)
+        return self.data[index]
+
+    def iter_columns(self) -> Iterator[Sequence[Any]]:
+        return (self.column(i) for i in range(len(self.columns)))
+
+    def iter_rows(self, start: int = 0, stop: int | None = None) -> Iterator[tuple]:
+        if not self.columns:
+            return iter(())
+        return islice(zip(*self.iter_columns()), start, stop)
+
+    def slice(self, start: int, stop: int | None = None) -> "ResultTable":
+        start, stop, _ = slice(start, stop).indices(self.row_count)
+        stop = max(start, stop)
+        data = []
+        for i, typecode in enumerate(self.typecodes):
+            if typecode:
+                size = array(typecode).itemsize
+                data.append(self.data[i][start * size:stop * size])
+            else:
+                data.append(self.data[i][start:stop])
+        return ResultTable(list(self.columns), list(self.typecodes), data, stop - start)
+
+    def head(self, n: int) -> "ResultTable":
+        return self.slice(0, n)
+
+    def tail(self, n: int) -> "ResultTable":
+        return self.slice(max(self.row_count - n, 0))
+
+    def to_records(self) -> list[dict]:
+        """Per-row dicts, for small samples handed to prompts and for legacy API responses."""
+        return [dict(zip(self.columns, row)) for row in self.iter_rows()]
+
+    def to_json(self) -> dict:
+        return {
+            "columns": self.columns,
+            "values": [column.tolist() if isinstance(column, memoryview) else column
+                       for column in self.iter_columns()]
+        }
+
+    def to_dataframe(self):
+        """pandas DataFrame sharing the typed buffers; pandas is only imported when plotting."""
+        import numpy as np
+        import pandas as pd
+
+        frame = pd.DataFrame({
+            i: np.frombuffer(self.data[i], dtype=_NUMPY_DTYPES[typecode]) if typecode else self.data[i]
+            for i, typecode in enumerate(self.typecodes)
+        })
+        # Positional keys above keep duplicate column names such as two joined "id"s apart
+        frame.columns = self.columns
+        return frame
+
+    @property
+    def nbytes(self) -> int:
+        """Rough number of bytes the table occupies, good enough for bounding caches."""
+        size = 0
+        for typecode, column in zip(self.typecodes, self.data):
+            if typecode:
+                size += len(column)
+                continue
+            size += 8 * len(column)
+            for value in column:
+                size += len(value) if isinstance(value, (str, bytes)) else 16
+        return size
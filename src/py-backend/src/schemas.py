@@ -4,6 +4,8 @@ from typing import List, Literal, Optional, Union
 from pydantic import BaseModel, Field
 from typing_extensions import TypedDict, Annotated
 from langchain_core.messages import BaseMessage
+
+from result_table import ResultTable
 from datetime import date
 
 
@@ -200,6 +202,25 @@ class QueryScope(BaseModel):
     timeFilter: TimeFilter
 
 
+class QueryPlan(BaseModel):
+    """Combined plan of relevant tables, activity filters and query scope."""
+    tables: List[Literal["window_activity", "user_input", "session"]] = Field(
+        ..., min_length=1, description="Names of the relevant tables in the SQL database."
+    )
+    activities: Optional[List[Activity]] = Field(
+        default=None,
+        description="One or more Activity(s) to filter the query. Only used if 'window_activity' is one of the tables."
+    )
+    aggregationFeature: Optional[AggregationFeature] = Field(
+        default=None,
+        description="One behavioral metric to aggregate from high-volume tables like 'window_activity' or 'user_input'."
+    )
+    timeGrouping: TimeGrouping = Field(
+        ..., description="Approximate time scope in order to determine granularity level."
+    )
+    timeFilter: TimeFilter
+
+
 class PlotOption(BaseModel):
     wantsPlot: WantsPlot = Field(
         ..., description="Whether the user expects a visual (yes), does not (no)"
@@ -211,6 +232,13 @@ class PythonOutput(TypedDict):
     code: Annotated[str, ..., "Syntactically valid python code to create visualizations."]
 
 
+class QueryBudget(BaseModel):
+    """Limits for executing a single SQL query."""
+    timeout_seconds: float = Field(default=180, gt=0)
+    max_rows: Optional[int] = Field(default=None, gt=0)
+    max_vm_steps: Optional[int] = Field(default=None, gt=0)
+
+
 class State(TypedDict):
     thread_id: str
     messages: List[BaseMessage]
@@ -222,10 +250,13 @@ class State(TypedDict):
     tables: List[str]
     activities: Optional[List[Activity]]
     query: str
-    raw_result: List[dict]
+    query_error: str | None
+    query_attempts: int
+    raw_result: Optional[ResultTable]
     result: str
     answer: str
     top_k: int
+    query_budget: Optional[QueryBudget]
     answer_detail: AnswerDetail
     last_query: str
     adjust_query: bool
@@ -238,5 +269,6 @@ class State(TypedDict):
     plot_base64: str | None
     plot_error: str | None
     plot_attempts: int
+    parallel_plot: bool
     auto_approve: bool
     auto_sql: bool
@@ -1,24 +1,44 @@
+import asyncio
 import logging
 import os
 import sys
 from contextlib import asynccontextmanager
 from typing import Optional
 
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Body, Request
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Body, Request, Query, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from pydantic import ValidationError
 
+from analytics_db import AnalyticsDB
+from chains.plot_chain import warm_plot_stack
 from chains.query_chain import correct_query, execute_corrected_query
-from chat_engine import run_chat, get_chat_history, initialize, delete_chat, rename_chat, resume_stream, \
-    update_sql_data, store_feedback
+from chat_engine import run_chat, get_chat_history, initialize, shutdown, delete_chat, rename_chat, resume_stream, \
+    update_sql_data, store_feedback, get_message_payload
 from helper.chat_utils import get_next_thread_id, list_chats
-from schemas import AnswerDetail, WantsPlot
+from helper.checkpoint_utils import compact_checkpoints, checkpoint_sizes
+from database import get_result_cache_stats
+from llm_registry import LLMRegistry
+from schemas import AnswerDetail, WantsPlot, QueryBudget
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     await initialize()
+    if os.getenv("PQ_WARM_PLOT_STACK", "1") == "1":
+        warm_plot_stack()
+    rollup_task = None
+    try:
+        # Must exist before the first query connection is opened, which attaches it
+        AnalyticsDB.ensure_schema()
+        rollup_task = asyncio.create_task(AnalyticsDB.refresh_async())
+    except Exception as e:
+        logging.warning(f"[lifespan] Analytics database unavailable: {e}")
     yield
     logging.info("Backend shutting down")
+    if rollup_task:
+        rollup_task.cancel()
+        await asyncio.gather(rollup_task, return_exceptions=True)
+    await shutdown()
 
 
 app = FastAPI(lifespan=lifespan)
@@ -48,6 +68,12 @@ async def websocket_chat(websocket: WebSocket):
             top_k = data.get("top_k", 150)
             auto_sql = data.get("auto_sql", True)
             auto_approve = data.get("auto_approve", False)
+            parallel_plot = data.get("parallel_plot", False)
+            try:
+                query_budget = QueryBudget(**data["query_budget"]) if data.get("query_budget") else None
+            except (TypeError, ValidationError) as e:
+                await websocket.send_json({"type": "error", "message": f"Invalid query budget: {e}"})
+                continue
 
             answer_detail = {
                 'low': AnswerDetail.LOW,
@@ -61,7 +87,8 @@ async def websocket_chat(websocket: WebSocket):
                 'auto': WantsPlot.AUTO
             }.get(data.get("wants_plot", "auto"), WantsPlot.AUTO)
 
-            msg = await run_chat(question, chat_id, top_k, auto_sql, auto_approve, answer_detail, wants_plot, websocket)
+            msg = await run_chat(question, chat_id, top_k, auto_sql, auto_approve, answer_detail, wants_plot,
+                                 parallel_plot, websocket, query_budget)
             if msg:
                 await websocket.send_json(msg)
 
@@ -78,15 +105,24 @@ async def create_chat():
 
 
 @app.get("/chats")
-async def get_all_chats():
-    """Return a list of all chat thread IDs."""
-    return {"chats": await list_chats()}
+async def get_all_chats(after: Optional[str] = None, limit: Optional[int] = Query(default=None, ge=1)):
+    """Return chats ordered by last activity. Pass `next_cursor` as `after` to get the next page."""
+    return await list_chats(after, limit)
 
 
 @app.get("/chats/{chat_id}")
-async def get_chat(chat_id: str):
-    """Return message history for a given chat."""
-    return await get_chat_history(chat_id)
+async def get_chat(chat_id: str,
+                   before: Optional[int] = Query(default=None, ge=0),
+                   limit: Optional[int] = Query(default=None, ge=1),
+                   exclude: Optional[list[str]] = Query(default=None)):
+    """Return message history for a given chat, optionally windowed and without large fields."""
+    return await get_chat_history(chat_id, before, limit, exclude)
+
+
+@app.get("/chats/{chat_id}/messages/{message_id}/payload")
+async def get_chat_message_payload(chat_id: str, message_id: str, fields: Optional[list[str]] = Query(default=None)):
+    """Return the result rows (`result`) and/or plot image (`plotBase64`) of one answer."""
+    return await get_message_payload(chat_id, message_id, fields)
 
 
 @app.delete("/chats/{chat_id}")
@@ -123,7 +159,7 @@ async def adjust_query(request: Request):
     query = payload.get("query")
     instruction = payload.get("instruction")
 
-    query = correct_query(query, instruction)
+    query = await correct_query(query, instruction)
     return query
 
 
@@ -131,8 +167,12 @@ async def adjust_query(request: Request):
 async def execute_query(request: Request):
     payload = await request.json()
     query = payload.get("query")
+    try:
+        query_budget = QueryBudget(**payload["query_budget"]) if payload.get("query_budget") else None
+    except (TypeError, ValidationError) as e:
+        raise HTTPException(status_code=422, detail=f"Invalid query budget: {e}")
 
-    result = execute_corrected_query(query)
+    result = await execute_corrected_query(query, query_budget)
     return result
 
 
@@ -160,6 +200,30 @@ async def submit_feedback(request: Request):
     return status
 
 
+@app.post("/maintenance/compact")
+async def compact():
+    """Drop intermediate checkpoints and report reclaimed bytes and per-thread sizes."""
+    return await compact_checkpoints()
+
+
+@app.get("/maintenance/checkpoints")
+async def get_checkpoint_sizes():
+    """Return number of checkpoints and stored bytes per thread."""
+    return {"threads": await checkpoint_sizes()}
+
+
+@app.get("/llm-cache")
+def llm_cache_stats():
+    """Return hit/miss counters and size of the LLM response cache."""
+    return LLMRegistry.cache_stats()
+
+
+@app.get("/sql-cache")
+def sql_cache_stats():
+    """Return hit/miss counters and size of the SQL result cache."""
+    return get_result_cache_stats()
+
+
 @app.get("/health")
 def health_check():
     return {"status": "ok"}